@@ -0,0 +1,824 @@
+"""The rules of the game 'love letter', independent of the web application.
+
+This module only depends upon the standard library, so that tools which only
+need to simulate or replay games, such as workers verifying stored games, do
+not pay for importing the web stack. Games are recorded as a log of entries,
+one per line, see `parse_log_entry`.
+"""
+
+from enum import IntEnum
+import itertools
+import random
+import string
+from collections import deque, namedtuple
+
+from app import metrics
+
+
+class Card(IntEnum):
+    princess = 8
+    countess = 7
+    king = 6
+    prince = 5
+    handmaid = 4
+    baron = 3
+    priest = 2
+    guard = 1
+
+card_pack = [Card.princess, Card.countess, Card.king, Card.prince,
+             Card.handmaid, Card.handmaid, Card.baron, Card.baron,
+             Card.priest, Card.priest,
+             Card.guard, Card.guard, Card.guard, Card.guard, Card.guard]
+
+MIN_PLAYERS = 2
+MAX_PLAYERS = 8
+# A single pack holds enough cards for four players, larger tables play with
+# an extended deck made of further copies of the pack.
+PLAYERS_PER_PACK = 4
+
+
+def player_names(num_players):
+    """ The names of the players for a game of the given size, in seat order.
+    These are 'a', 'b', 'c' and so on. Note that player names must not contain
+    any of the characters used as separators in the log.
+    """
+    return list(string.ascii_lowercase[:num_players])
+
+
+def card_pack_for(num_players):
+    """ The pack of cards used for a game with the given number of players."""
+    num_packs = 1 + (num_players - 1) // PLAYERS_PER_PACK
+    return card_pack * num_packs
+
+
+class NotYourTurnException(Exception):
+    """ An exception to raise when a player attempts to play out of turn."""
+    pass
+
+
+class CountessForcedException(Exception):
+    """ An exception to be raised whenever a player attempts to play a king or
+        a prince when holding on to the Countess
+    """
+    pass
+
+
+class NoNominatedPlayerException(Exception):
+    """An exception to raise whenever a player does not nominate a player.
+    Some cards, namely, the guard, priest, baron, prince and king require that
+    you nominate a player (unless all other players are handmaided). This is
+    the exception to raise if a player fails to do so.
+    """
+    pass
+
+
+class GameFinished(Exception):
+    """An exception to raise when the game is over.
+    The game is over either because there is only a single player left,
+    or because there are no cards left to draw.
+    """
+    pass
+
+
+def format_none(value, format_fun=str):
+    """ Utility function to format a value as a string when the value may be
+    'None', in which case we want the empty string.
+    """
+    return '' if value is None else format_fun(value)
+
+
+class Move(object):
+    """A class for describing a move made in the game."""
+
+    def __init__(self, who, card, nominated_player=None, nominated_card=None):
+        """Simple constructor. Nominated_player and nominated_card are optional
+        since not all moves require either.
+        """
+        self.player = who
+        self.card = card
+        self.nominated_player = nominated_player
+        self.nominated_card = nominated_card
+
+    def to_log_string(self):
+        nom_player = format_none(self.nominated_player, str)
+        nom_card = format_none(self.nominated_card,
+                               format_fun=lambda x: str(x.value))
+        log_entry = ",".join([self.player,
+                              str(self.card.value),
+                              nom_player,
+                              nom_card])
+        return log_entry
+
+    def obscure(self, player):
+        """ Moves are always visible by everyone."""
+        return self
+
+    def encode(self, players):
+        """ Encode the move, other than who is making it, as a small integer.
+        The nominated player is encoded by their position in the given list of
+        the players in the game, see `decode_move`.
+        """
+        nom_player = 0
+        if self.nominated_player is not None:
+            nom_player = players.index(self.nominated_player) + 1
+        nom_card = 0 if self.nominated_card is None else self.nominated_card
+        return int(self.card) + CARD_CODES * (nom_card +
+                                              CARD_CODES * nom_player)
+
+
+# The number of values a card takes in an encoded move, allowing for none.
+CARD_CODES = len(Card) + 1
+
+
+def decode_move(who, code, players):
+    """ Decode a move made by the given player, see `Move.encode`."""
+    code, card = divmod(code, CARD_CODES)
+    nom_player, nom_card = divmod(code, CARD_CODES)
+    if not 0 < card < CARD_CODES or nom_player > len(players):
+        raise ValueError("Invalid move code")
+    return Move(who, Card(card),
+                nominated_player=(players[nom_player - 1] if nom_player
+                                  else None),
+                nominated_card=Card(nom_card) if nom_card else None)
+
+
+class DiscardLog(object):
+    def __init__(self, player, card):
+        self.player = player
+        self.card = card
+
+    def to_log_string(self):
+        return '{0}-{1}'.format(self.player, self.card)
+
+    def obscure(self, player):
+        """Discards are always visible by everyone so this is simple."""
+        return self
+
+
+class PickupLog(object):
+    def __init__(self, player, card):
+        self.player = player
+        self.card = card
+
+    def to_log_string(self):
+        return '{0}:{1}'.format(self.player, self.card)
+
+    def obscure(self, player):
+        return self if player == self.player else __class__(self.player, '?')
+
+
+class PriestLog(object):
+    def __init__(self, player_shows, player_sees, card):
+        self.player_shows = player_shows
+        self.player_sees = player_sees
+        self.card = card
+
+    def to_log_string(self):
+        return '{0};{1};{2}'.format(self.player_shows, self.player_sees,
+                                    self.card)
+
+    def obscure(self, player):
+        if player in [self.player_shows, self.player_sees]:
+            return self
+        else:
+            return __class__(self.player_shows, self.player_sees, '?')
+
+PossibleMoves = namedtuple('PossibleMove', ["card", "moves"])
+
+# A move registered by a player ahead of their turn, to be played if they
+# draw the given card, or whatever they draw if that is None.
+PreMove = namedtuple('PreMove', ["drawn", "move"])
+
+
+def find_premove(game, premoves):
+    """ The index of the first of the given pre-moves which the player whose
+    turn it is should play, or None if there is none. A pre-move is played if
+    it is the player's, they drew its card and its move is available to them.
+    """
+    player, _, drawn = game.on_turn
+    available = {move.to_log_string()
+                 for possible in game.available_moves()
+                 for move in possible.moves}
+    for index, premove in enumerate(premoves):
+        if premove.move.player != player:
+            continue
+        if premove.drawn is not None and premove.drawn != drawn:
+            continue
+        if premove.move.to_log_string() in available:
+            return index
+    return None
+
+
+def parse_card(field):
+    """ Parse a card from a log, obscured cards are left as '?'."""
+    return field if field == '?' else Card(int(field))
+
+
+def parse_log_entry(line):
+    """ Parse a single line of a log into the log entry it represents. The
+    kind of entry is determined by the separator used, so player names must
+    not contain any of the separators.
+    """
+    if ',' in line:
+        player, card, nom_player, nom_card = line.split(",")
+        return Move(player, Card(int(card)),
+                    nominated_player=nom_player or None,
+                    nominated_card=Card(int(nom_card)) if nom_card else None)
+    elif ':' in line:
+        player, card = line.split(":")
+        return PickupLog(player, parse_card(card))
+    elif ';' in line:
+        player_shows, player_sees, card = line.split(";")
+        return PriestLog(player_shows, player_sees, parse_card(card))
+    elif '-' in line:
+        player, card = line.split("-")
+        return DiscardLog(player, parse_card(card))
+    raise ValueError("Unrecognised log entry: {0!r}".format(line))
+
+
+def _split_lines(text, newline):
+    """ Yield the non-empty lines of the given text without splitting the
+        whole text up front.
+    """
+    start = 0
+    while start < len(text):
+        end = text.find(newline, start)
+        if end == -1:
+            end = len(text)
+        if end > start:
+            yield text[start:end]
+        start = end + 1
+
+
+def iter_log_lines(source):
+    """ Yield the lines of a log one at a time. The source may be the log as
+    a string or as bytes, or an iterable of chunks of the log. A chunk given
+    as a string or as bytes, such as a line of a file or a block read from
+    one, may end part way through a line, which is then continued by the
+    following chunks. Otherwise a chunk is a row of a database cursor, whose
+    first column holds one or more whole lines of the log.
+    """
+    if isinstance(source, str):
+        yield from _split_lines(source, '\n')
+    elif isinstance(source, (bytes, bytearray)):
+        for line in _split_lines(source, b'\n'):
+            yield line.decode('utf-8')
+    else:
+        # The unfinished last line of the chunks so far.
+        partial = None
+        for chunk in source:
+            if not isinstance(chunk, (str, bytes, bytearray)):
+                if partial:
+                    yield from iter_log_lines(partial)
+                partial = None
+                yield from iter_log_lines(chunk[0])
+                continue
+            if not chunk:
+                # An empty chunk, such as the last read at the end of a file,
+                # neither ends nor continues the unfinished line.
+                continue
+            if partial:
+                chunk = partial + chunk
+            end = chunk.rfind('\n' if isinstance(chunk, str) else b'\n') + 1
+            partial = chunk[end:]
+            yield from iter_log_lines(chunk[:end])
+        if partial:
+            yield from iter_log_lines(partial)
+
+
+def count_moves(source):
+    """ Count the moves in a log without parsing it into log entries."""
+    return sum(1 for line in iter_log_lines(source) if ',' in line)
+
+
+def iter_log_entries(source):
+    """ A streaming parser, yields the log entries of the given log source,
+        see `iter_log_lines`, as they are read.
+    """
+    for line in iter_log_lines(source):
+        yield parse_log_entry(line)
+
+
+RECORD_FIELDS = ['game_id', 'seq', 'type', 'player', 'card', 'target',
+                 'guess']
+
+
+def log_entry_record(game_id, seq, entry):
+    """ A flat record of the log entry at position `seq` of a game's log, for
+    export. The target is the nominated player of a move or the player seeing
+    a priest, and the guess is the nominated card of a move.
+    """
+    record = dict.fromkeys(RECORD_FIELDS)
+    record.update(game_id=game_id, seq=seq)
+    if isinstance(entry, PriestLog):
+        record.update(type='priest', player=entry.player_shows,
+                      target=entry.player_sees)
+    else:
+        record['player'] = entry.player
+    if isinstance(entry, Move):
+        record.update(type='move', target=entry.nominated_player)
+        if entry.nominated_card is not None:
+            record['guess'] = int(entry.nominated_card)
+    elif isinstance(entry, PickupLog):
+        record['type'] = 'pickup'
+    elif isinstance(entry, DiscardLog):
+        record['type'] = 'discard'
+    record['card'] = entry.card if entry.card == '?' else int(entry.card)
+    return record
+
+
+def record_log_entry(record):
+    """ The log entry given by a record, see `log_entry_record`."""
+    card = record['card'] if record['card'] == '?' else Card(record['card'])
+    if record['type'] == 'move':
+        guess = record['guess']
+        return Move(record['player'], card,
+                    nominated_player=record['target'],
+                    nominated_card=None if guess is None else Card(guess))
+    elif record['type'] == 'pickup':
+        return PickupLog(record['player'], card)
+    elif record['type'] == 'discard':
+        return DiscardLog(record['player'], card)
+    elif record['type'] == 'priest':
+        return PriestLog(record['player'], record['target'], card)
+    raise ValueError("Unrecognised record type: {0!r}".format(record['type']))
+
+
+class Game(object):
+    """The main game class representing a game currently in play."""
+    def __init__(self, players, deck=None, discarded=None, log=None,
+                 moves=None, checkpoint=None):
+        self.players = players
+        self.pack = card_pack_for(len(players))
+        self.num_moves = 0
+        self.handmaided = set()
+        self.out_players = set()
+        self.hands = dict()
+        self.log = []
+        self.winners = None
+        self.winning_card = None
+        self.on_turn = None
+
+        if log is None:
+            if deck is None:
+                # If we are not setting the deck then we assume that we are
+                # wanting a random deck so we randomly shuffle the cards and
+                # choose a random one as the discarded.
+                self.deck = self.pack.copy()
+                random.shuffle(self.deck)
+                self.deck = deque(self.deck)
+                self.discarded = self.deck.popleft()
+            else:
+                # If we are setting the deck we assume that we are in a test
+                # mode so we set the known deck and either we know that our test
+                # does not need a discarded card or we want to know what it is.
+                self.deck = deque(deck)
+                self.discarded = discarded
+
+            # Begin the game by dealing a card to each player
+            for p in self.players:
+                card = self.deck.popleft()
+                self.hands[p] = card
+                self.log.append(PickupLog(p, card))
+            # And drawing a card for the first player:
+            self.draw_card()
+        else:
+            entries = metrics.timed_iter('log_parse', iter_log_entries(log))
+            with metrics.timer('replay'):
+                self.replay(entries, moves=moves, checkpoint=checkpoint)
+
+    def replay(self, entries, moves=None, checkpoint=None):
+        """ Restore the game by replaying the given stream of log entries.
+
+        The entries are consumed lazily, so the log is never held in memory
+        as a whole. Only the pickups are needed to restore the deck, and each
+        move is played once we have read as far as the next move, by which
+        time all the cards the move may draw have been seen. Any cards not
+        drawn in the log are shuffled onto the end of the deck. If `moves` is
+        given we stop after replaying that many moves. If a `checkpoint` is
+        given we restore the game from it and replay only the moves after it.
+        """
+        self.discarded = None
+        self.deck = deque()
+        unseen = self.pack.copy()
+        if checkpoint is None:
+            for _ in range(len(self.players)):
+                pickup = next(entries)
+                self.hands[pickup.player] = pickup.card
+                self.log.append(pickup)
+                unseen.remove(pickup.card)
+        else:
+            self.restore(checkpoint)
+            for entry in itertools.islice(entries, checkpoint['entries']):
+                self.log.append(entry)
+                if isinstance(entry, PickupLog):
+                    unseen.remove(entry.card)
+
+        pending = None
+        for entry in entries:
+            if isinstance(entry, PickupLog):
+                self.deck.append(entry.card)
+                unseen.remove(entry.card)
+            elif isinstance(entry, Move):
+                if pending is not None:
+                    self.replay_move(pending)
+                    pending = None
+                if moves is not None and self.num_moves >= moves:
+                    break
+                pending = entry
+
+        random.shuffle(unseen)
+        # It is possible there is no discarded because all the cards were
+        # used up. This would happen if we are loading the log of a game
+        # that finished with someone playing the prince forcing someone
+        # else to take the discarded card. So we have to check that the
+        # rest of the deck is not empty.
+        if unseen:
+            self.discarded = unseen.pop()
+        self.deck += unseen
+        if pending is not None:
+            self.replay_move(pending)
+        elif self.on_turn is None and not self.num_moves:
+            self.draw_card()
+
+    def replay_move(self, move):
+        """ Play a move read from a log, the first move of the log must be
+            preceded by drawing a card for the first player.
+        """
+        if self.on_turn is None and not self.num_moves:
+            self.draw_card()
+        self.play_move(move)
+
+    def parse_action(self, line):
+        return parse_log_entry(line)
+
+    def checkpoint(self):
+        """ A snapshot of the state of the game, as a JSON serialisable dict,
+        from which the game can be restored without replaying the moves before
+        it. The deck is not included, since on restoring the moves after the
+        checkpoint the deck is rebuilt from the rest of the log. Hence this is
+        only valid between moves, when the player on turn has drawn their card.
+        """
+        def value(card):
+            return None if card is None else card.value
+
+        winners = None if self.winners is None else sorted(self.winners)
+        on_turn = None
+        if self.on_turn is not None:
+            player, card_one, card_two = self.on_turn
+            on_turn = [player, value(card_one), value(card_two)]
+        return {'moves': self.num_moves,
+                'entries': len(self.log),
+                'players': list(self.players),
+                'hands': {p: value(c) for p, c in self.hands.items()},
+                'on_turn': on_turn,
+                'handmaided': sorted(self.handmaided),
+                'out_players': sorted(self.out_players),
+                'winners': winners,
+                'winning_card': value(self.winning_card)}
+
+    def restore(self, checkpoint):
+        """ Restore the state of the game, other than the log and the deck,
+            from a checkpoint, see `checkpoint`.
+        """
+        def card(value):
+            return None if value is None else Card(value)
+
+        self.num_moves = checkpoint['moves']
+        self.players = list(checkpoint['players'])
+        self.hands = {p: card(c) for p, c in checkpoint['hands'].items()}
+        self.on_turn = None
+        if checkpoint['on_turn'] is not None:
+            player, card_one, card_two = checkpoint['on_turn']
+            self.on_turn = player, card(card_one), card(card_two)
+        self.handmaided = set(checkpoint['handmaided'])
+        self.out_players = set(checkpoint['out_players'])
+        if checkpoint['winners'] is not None:
+            self.winners = set(checkpoint['winners'])
+        self.winning_card = card(checkpoint['winning_card'])
+
+    def serialise_game(self, player=None):
+        """ Serialise the game, if player is given then the serialised log is
+        sanitised such that the player cannot see information that they should
+        not. However, this is mostly for testing purposes, in general
+        serialise_game is used internally to store the game in the database and
+        not to pass information to the players.
+        """
+        log = self.log_for_player(player) if player else self.log
+        return "\n".join([l.to_log_string() for l in log])
+
+    def log_for_player(self, player):
+        """Returns a log sanitised by hiding information not available to
+           to everyone, unless it is available to the given player. Note that,
+           this means if you provide a player not in the game (eg. None) then
+           this will return a log which hides all non-public information.
+        """
+        return [l.obscure(player) for l in self.log]
+
+    def take_top_card(self):
+        return self.deck.popleft()
+
+    def draw_card(self, card=None):
+        """ You can draw a known card, this is useful for restoring a game from
+            a log.
+        """
+        assert self.on_turn is None
+        if card is None:
+            if self.is_game_finished():
+                raise GameFinished()
+            else:
+                card = self.take_top_card()
+        player = self.players.pop(0)
+        # If the player is handmaided, they are now not handmaided.
+        self.handmaided.discard(player)
+        old_card = self.hands[player]
+        self.on_turn = player, old_card, card
+        self.log.append(PickupLog(player, card))
+
+    def live_players(self):
+        on_turn = [] if self.on_turn is None else [self.on_turn[0]]
+        return on_turn + self.players
+
+    def is_game_finished(self):
+        completed_deck = self.on_turn is None and not self.deck
+        one_player = len(self.live_players()) <= 1
+        return completed_deck or one_player
+
+    def is_players_turn(self, player):
+        return self.on_turn is not None and self.on_turn[0] == player
+
+    def _available_moves_for_card(self, player, card, other_card):
+        """ Return the moves available for the first given card. The second
+            given card is only included so that the countess rules can be
+            applied to the prince and king cards, but note we are not
+            considering any moves playable by the second given card.
+        """
+        if card in [Card.prince, Card.king] and other_card == Card.countess:
+            # It may seem strange that we do not return the countess move but
+            # that should be returned by the other call to this method.
+            return []
+        elif card == Card.guard:
+            # You cannot guard a guard. You can guess any other card, here we
+            # do not prevent you from being stupid and guessing something that
+            # has already been discarded.
+            guessable_cards = list(Card)
+            guessable_cards.remove(Card.guard)
+            open_players = [p for p in self.players if p not in self.handmaided]
+            if open_players:
+                return [Move(player, card, nominated_player=p, nominated_card=c)
+                        for p in open_players for c in guessable_cards]
+            else:
+                # All opponents are handmaided, but you can discard the guard.
+                return [Move(player, card)]
+        elif card in [Card.priest, Card.baron, Card.king]:
+            # If all other players are handmaided you can simply discard the
+            # card. This means that you cannot choose to discard these cards
+            # if not all remaining players are handmaided, which would be useful
+            # if you for example have two barons, or a king and the princess.
+            open_players = [p for p in self.players if p not in self.handmaided]
+            if not open_players:
+                return [Move(player, card)]
+            return [Move(player, card, nominated_player=p)
+                    for p in open_players]
+        elif card == Card.prince:
+            # Slightly different from the priest, baron and king above
+            # in that you must always prince someone and that someone can
+            # always be you.
+            open_players = [p for p in self.players if p not in self.handmaided]
+            return [Move(player, card, nominated_player=p)
+                    for p in [player] + open_players]
+        elif card in [Card.handmaid, Card.countess, Card.princess]:
+            # You can always play any of these three cards, of course playing
+            # the princess will lose you the game.
+            return [Move(player, card)]
+        raise Exception("Invalid card for available moves.")
+
+    @metrics.timed('available_moves')
+    def available_moves(self):
+        player, card_one, card_two = self.on_turn
+        moves_one = self._available_moves_for_card(player, card_one, card_two)
+        pmoves_one = PossibleMoves(card=card_one, moves=moves_one)
+        moves_two = self._available_moves_for_card(player, card_two, card_one)
+        pmoves_two = PossibleMoves(card=card_two, moves=moves_two)
+        return (pmoves_one, pmoves_two)
+
+    def play_turn(self, move_string):
+        self.play_move(self.parse_action(move_string))
+
+    def play_move(self, move):
+        who = move.player
+        card = move.card
+        nominated_player = move.nominated_player
+        nominated_card = move.nominated_card
+        # In theory we should set self.on_turn to None, but we back-out of some
+        # moves because it is illegal and for testing purposes it is nice to be
+        # able to continue with the game after a failed move. But it would be
+        # nice to be able to make sure a player is out of the game, which simply
+        # inspecting self.players does not quite do.
+        player, card_one, card_two = self.on_turn
+
+        # Some cards force others to discard their cards, possibly by being
+        # out of the game. The prince forces you to discard and pickup, but we
+        # do not want to log these events as occuring *before* the current play.
+        # So we store them up and then log them only after the current play is
+        # logged.
+        discard_logs = []
+
+        def log_discard(player, out_card):
+            discard_logs.append(DiscardLog(player, out_card))
+
+        def log_extra_pickup(pickup_player, extra_card):
+            discard_logs.append(PickupLog(pickup_player, extra_card))
+
+        def log_play():
+            """ We define this as a method rather than simply doing this now,
+                because we may back out of this if the move is not valid.
+            """
+            self.log.append(move)
+            for l in discard_logs:
+                self.log.append(l)
+
+        def eliminate_player(eliminated):
+            self.hands[eliminated] = None
+            self.out_players.add(eliminated)
+            if eliminated != player:
+                self.players.remove(eliminated)
+
+        all_opponents_handmaided = all(p in self.handmaided
+                                       for p in self.players)
+
+        if player != who:
+            msg_fmt = "It's not your turn: {0} != {1}, {2}"
+            message = msg_fmt.format(player, who, str(self.players))
+            raise NotYourTurnException(message)
+        if card not in [card_one, card_two]:
+            raise Exception("Illegal attempt to play a card you do not have.")
+        kept_card = card_two if card == card_one else card_one
+
+        if card == Card.guard:
+            if nominated_player is None:
+                if not all_opponents_handmaided:
+                    raise NoNominatedPlayerException()
+
+                # Otherwise that's fine then, we just discard the card and
+                # carry on. We possibly should also check that the nominated
+                # card is also None.
+            elif nominated_player not in self.players:
+                raise Exception("You cannot guard someone who is already out")
+            elif nominated_card is None:
+                raise Exception("You have to nominate a card to play the guard")
+            elif nominated_card == Card.guard:
+                raise Exception("You cannot guard a guard")
+            elif nominated_player in self.handmaided:
+                raise Exception("You cannot guard a handmaided player.")
+            else:
+                nominated_players_card = self.hands[nominated_player]
+                if nominated_card == nominated_players_card:
+                    # Nominated player is out of the game
+                    log_discard(nominated_player, self.hands[nominated_player])
+                    eliminate_player(nominated_player)
+
+        elif card == Card.priest:
+            # For a priest card we have to log who has been priested by whom,
+            # so that in the player's (the one priesting) log they will see the
+            # card shown to them. In addition of course we have to check that
+            # you are not attempting to preist a player who is handmaided
+            if nominated_player is None:
+                if all_opponents_handmaided:
+                    # That's fine then, we just discard the card and carry on
+                    # We possibly should also check that the nominated card is
+                    # also None.
+                    pass
+                else:
+                    raise NoNominatedPlayerException()
+            elif nominated_player not in self.players:
+                raise Exception("You must baron a player still in the game.")
+            elif nominated_player in self.handmaided:
+                raise Exception("You cannot baron a handmaided player.")
+            else:
+                # In this case we have a valid use of the priest card that is
+                # not simply discarding because all opponents are handmaided.
+                seen_card = self.hands[nominated_player]
+                log_entry = PriestLog(nominated_player, player, seen_card)
+                discard_logs.append(log_entry)
+        elif card == Card.baron:
+            if nominated_player is None:
+                if all_opponents_handmaided:
+                    # That's fine then, we just discard the card and carry on
+                    # We possibly should also check that the nominated card is
+                    # also None.
+                    pass
+                else:
+                    raise NoNominatedPlayerException()
+            elif nominated_player not in self.players:
+                raise Exception("You must baron a player still in the game.")
+            elif nominated_player in self.handmaided:
+                raise Exception("You cannot baron a handmaided player.")
+            else:
+                opponents_card = self.hands[nominated_player]
+                if kept_card > opponents_card:
+                    log_discard(nominated_player, opponents_card)
+                    eliminate_player(nominated_player)
+                elif opponents_card > kept_card:
+                    # The current player is out of the game
+                    log_discard(player, kept_card)
+                    eliminate_player(player)
+                # If the cards are equal nothing happens.
+
+        elif card == Card.handmaid:
+            self.handmaided.add(player)
+
+        elif card == Card.prince:
+            if kept_card == Card.countess:
+                raise CountessForcedException("You have a prince")
+            elif nominated_player is None:
+                raise NoNominatedPlayerException()
+            elif nominated_player not in [player] + self.players:
+                raise Exception("You must prince a player still in the game.")
+            elif nominated_player in self.handmaided:
+                raise Exception("You cannot prince a handmaided player.")
+            # Note: unlike the king below you cannot simply discard the prince,
+            # if all other players are handmaided you have to prince yourself.
+            elif nominated_player == player:
+                log_discard(nominated_player, kept_card)
+                if kept_card == Card.princess:
+                    # Oh oh, you're out of the game!
+                    eliminate_player(player)
+                else:
+                    try:
+                        new_card = self.take_top_card()
+                    except IndexError:
+                        new_card = self.discarded
+                    log_extra_pickup(player, new_card)
+                    kept_card = new_card
+            else:
+                discarded = self.hands[nominated_player]
+                log_discard(nominated_player, discarded)
+                if discarded == Card.princess:
+                    # Oh oh, that player is forced to discard the princess and
+                    # is hence out of the game.
+                    eliminate_player(nominated_player)
+                else:
+                    # Otherwise give them a new card. Note that if the deck is
+                    # empty they are given the card that was discarded from the
+                    # deck at the start (to ensure there is not total knowledge
+                    # of the deck).
+                    try:
+                        new_card = self.take_top_card()
+                    except IndexError:
+                        new_card = self.discarded
+                    log_extra_pickup(nominated_player, new_card)
+                    self.hands[nominated_player] = new_card
+
+        elif card == Card.king:
+            # Note, if you are forced to swap the princess I don't think this
+            # counts as discarding it, so you're not out, so we do not check
+            # for that here.
+
+            if kept_card == Card.countess:
+                raise CountessForcedException("You have a king")
+            elif nominated_player is None:
+                if not all_opponents_handmaided:
+                    raise NoNominatedPlayerException()
+                # If all opponents are handmaided then playing the king
+                # becomes a simple discard.
+            elif nominated_player not in self.players:
+                raise Exception("You must king a player still in the game.")
+            elif nominated_player in self.handmaided:
+                raise Exception("You cannot king a handmaided player.")
+            else:
+                # Swap the cards, not using a,b = b,a for pep8 reasons.
+                opponents_card = self.hands[nominated_player]
+                self.hands[nominated_player] = kept_card
+                kept_card = opponents_card
+
+        elif card == Card.countess:
+            # This is fine, we need to check above that a player never manages
+            # to avoid discarding the countess when they hold the prince or the
+            # king, but discarding the countess is always fine, but has no
+            # effect, other than to add the discard.
+            pass
+
+        elif card == Card.princess:
+            # The player is out, so do not append them to the back of the
+            # players list.
+            eliminate_player(player)
+
+        log_play()
+        self.num_moves += 1
+        if player not in self.out_players:
+            self.hands[player] = kept_card
+            self.players.append(player)
+        self.on_turn = None
+        if self.is_game_finished():
+            for p in self.players:
+                if self.winning_card is None:
+                    self.winning_card = self.hands[p]
+                    self.winners = {p}
+                elif self.hands[p] > self.winning_card:
+                    self.winning_card = self.hands[p]
+                    self.winners = {p}
+                elif self.hands[p] == self.winning_card:
+                    self.winners.add(p)
+        else:
+            self.draw_card()
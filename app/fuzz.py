@@ -0,0 +1,338 @@
+"""Differential fuzzing of the ways a game may be restored.
+
+A game in play is held in several forms: the `Game` being played, the game
+replayed from its serialised log, and the game restored from a checkpoint and
+the rest of its log. These must all agree. A fuzz case is a dealt pack and a
+tape of numbers which picks the move to try at each step, either one of the
+legal moves or an illegal one which the engine must refuse with the matching
+exception. Each case is played through the reference engine, a `Game`
+played directly, and through each candidate engine, which keeps only what
+would be stored between requests. After every step the exception raised, if
+any, and the state and logs of each candidate are compared with those of the
+reference.
+
+When a case finds a mismatch it is shrunk, by cutting the tape and lowering
+its numbers for as long as the mismatch remains, so that what is reported is
+a short reproducer rather than the whole random game.
+"""
+
+import json
+import random
+from collections import deque, namedtuple
+
+from app.engine import (
+    Card, CountessForcedException, Game, MAX_PLAYERS, MIN_PLAYERS, Move,
+    NoNominatedPlayerException, NotYourTurnException, PickupLog, card_pack_for,
+    player_names)
+
+# The largest number on a generated tape.
+TAPE_LIMIT = 1 << 16
+
+# One step in this many, on average, tries an illegal move.
+ILLEGAL_ODDS = 4
+
+Mismatch = namedtuple('Mismatch', ['step', 'engine', 'field', 'expected',
+                                   'actual'])
+
+
+class Case(object):
+    """ A game dealt from the given deck, with the discarded card put aside,
+    and played by the moves picked by the tape.
+    """
+    def __init__(self, num_players, deck, discarded, tape):
+        self.num_players = num_players
+        self.deck = list(deck)
+        self.discarded = discarded
+        self.tape = list(tape)
+
+    @classmethod
+    def generate(cls, rng, max_steps=40):
+        num_players = rng.randint(MIN_PLAYERS, MAX_PLAYERS)
+        pack = card_pack_for(num_players)
+        rng.shuffle(pack)
+        tape = [rng.randrange(TAPE_LIMIT) for _ in range(max_steps)]
+        return cls(num_players, pack[1:], pack[0], tape)
+
+    def replace(self, tape):
+        return Case(self.num_players, self.deck, self.discarded, tape)
+
+    def players(self):
+        return player_names(self.num_players)
+
+    def new_game(self):
+        return Game(self.players(), deck=self.deck, discarded=self.discarded)
+
+    def to_json(self):
+        return json.dumps({'num_players': self.num_players,
+                           'deck': [int(c) for c in self.deck],
+                           'discarded': int(self.discarded),
+                           'tape': self.tape})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['num_players'], [Card(c) for c in data['deck']],
+                   Card(data['discarded']), data['tape'])
+
+
+def illegal_moves(game):
+    """ Moves the player on turn, or another player, might try but which must
+    be refused, each paired with the exception they must be refused with.
+    """
+    player, card_one, card_two = game.on_turn
+    open_players = [p for p in game.players if p not in game.handmaided]
+    moves = [(Move(p, card_one), NotYourTurnException)
+             for p in game.players]
+    for card, other_card in [(card_one, card_two), (card_two, card_one)]:
+        if card in [Card.prince, Card.king] and other_card == Card.countess:
+            nominated = open_players[0] if open_players else player
+            moves.append((Move(player, card, nominated_player=nominated),
+                          CountessForcedException))
+        elif card == Card.prince or (open_players and card in [
+                Card.guard, Card.priest, Card.baron, Card.king]):
+            moves.append((Move(player, card), NoNominatedPlayerException))
+    return moves
+
+
+def pick(game, number):
+    """ The move, and the exception it must raise if it is illegal, picked by
+    the given number from the tape, along with the smallest number which
+    picks the same move.
+    """
+    illegal = illegal_moves(game)
+    if illegal and number % ILLEGAL_ODDS == 0:
+        # Pick the kind of illegal move first, so that the rarer kinds are
+        # not swamped by the moves out of turn, of which there are many.
+        kinds = sorted({must_raise for _, must_raise in illegal},
+                       key=lambda kind: kind.__name__)
+        move_index, kind_index = divmod(number // ILLEGAL_ODDS, len(kinds))
+        kind = kinds[kind_index]
+        moves = [move for move, must_raise in illegal if must_raise is kind]
+        move_index %= len(moves)
+        smallest = kind_index + len(kinds) * move_index
+        return moves[move_index], kind, smallest * ILLEGAL_ODDS
+    pmoves_one, pmoves_two = game.available_moves()
+    legal = pmoves_one.moves + pmoves_two.moves
+    index = number // ILLEGAL_ODDS % len(legal)
+    return legal[index], None, index * ILLEGAL_ODDS + 1
+
+
+class ReferenceEngine(object):
+    """ The game played directly."""
+    def __init__(self, case):
+        self.game = case.new_game()
+
+    def current(self):
+        return self.game
+
+    def play_move(self, move):
+        self.game.play_move(move)
+
+
+class ReplayEngine(object):
+    """ The game replayed from its serialised log at every step, as when it
+    is loaded from the database with no checkpoint.
+
+    A replayed game does not know the order of the cards not yet drawn, so
+    they are shuffled. Those cards are checked to be the right ones and then
+    put back in the order of the case's deck, so that the reference and the
+    candidate draw the same cards from then on.
+    """
+    def __init__(self, case):
+        self.case = case
+        self.save(case.new_game())
+
+    def save(self, game):
+        self.log = game.serialise_game()
+
+    def restore(self):
+        return Game(self.case.players(), log=self.log)
+
+    def current(self):
+        game = self.restore()
+        drawn = sum(1 for entry in game.log if isinstance(entry, PickupLog))
+        remaining = self.case.deck[drawn:]
+        discarded = self.case.discarded if drawn <= len(self.case.deck) \
+            else None
+        unseen = list(game.deck) + [game.discarded]
+        if sorted(c for c in unseen if c is not None) != \
+                sorted(remaining + [c for c in [discarded] if c is not None]):
+            raise AssertionError("Restored the wrong unseen cards: {0}"
+                                 .format(unseen))
+        game.deck = deque(remaining)
+        game.discarded = discarded
+        return game
+
+    def play_move(self, move):
+        game = self.current()
+        game.play_move(move)
+        self.save(game)
+
+
+class SnapshotEngine(ReplayEngine):
+    """ The game restored from the checkpoint taken after the last move and
+    the log, as when it is loaded with a cached snapshot. The checkpoint is
+    passed through JSON as it would be when stored.
+    """
+    def save(self, game):
+        super().save(game)
+        self.checkpoint = json.loads(json.dumps(game.checkpoint()))
+
+    def restore(self):
+        return Game(self.case.players(), log=self.log,
+                    checkpoint=self.checkpoint)
+
+
+CANDIDATES = {'replay': ReplayEngine, 'snapshot': SnapshotEngine}
+
+
+def game_state(game, players):
+    """ Everything about a game that the engines must agree on."""
+    state = {'checkpoint': game.checkpoint(),
+             'deck': [int(c) for c in game.deck],
+             'finished': game.is_game_finished(),
+             'log': game.serialise_game()}
+    for player in players:
+        log = game.log_for_player(player)
+        state['log:' + player] = [entry.to_log_string() for entry in log]
+    return state
+
+
+def try_move(engine, move):
+    """ Play the move, returning the type of exception raised if any."""
+    try:
+        engine.play_move(move)
+    except Exception as exception:
+        return type(exception)
+    return None
+
+
+def run_case(case, candidates=None):
+    """ Play the case through the reference and candidate engines, returning
+        the first mismatch found, or None if they all agreed throughout.
+    """
+    if candidates is None:
+        candidates = CANDIDATES
+    players = case.players()
+    reference = ReferenceEngine(case)
+    engines = []
+    for name, candidate in sorted(candidates.items()):
+        try:
+            engines.append((name, candidate(case)))
+        except Exception as exception:
+            return Mismatch(0, name, 'exception', None, repr(exception))
+
+    for step in range(len(case.tape) + 1):
+        expected = game_state(reference.current(), players)
+        for name, engine in engines:
+            try:
+                actual = game_state(engine.current(), players)
+            except Exception as exception:
+                return Mismatch(step, name, 'exception', None,
+                                repr(exception))
+            for field in sorted(expected):
+                if actual.get(field) != expected[field]:
+                    return Mismatch(step, name, field, expected[field],
+                                    actual.get(field))
+        if step == len(case.tape) or reference.current().is_game_finished():
+            return None
+
+        move, must_raise, _ = pick(reference.current(), case.tape[step])
+        raised = try_move(reference, move)
+        if raised is not must_raise:
+            return Mismatch(step, 'reference', 'exception', must_raise,
+                            raised)
+        for name, engine in engines:
+            candidate_raised = try_move(engine, move)
+            if candidate_raised is not raised:
+                return Mismatch(step, name, 'exception', raised,
+                                candidate_raised)
+    return None
+
+
+def normalise(case):
+    """ The case with each number of its tape replaced by the smallest number
+        picking the same move.
+    """
+    game = case.new_game()
+    tape = []
+    for number in case.tape:
+        if game.is_game_finished():
+            break
+        move, _, smallest = pick(game, number)
+        tape.append(smallest)
+        try:
+            game.play_move(move)
+        except Exception:
+            pass
+    return case.replace(tape)
+
+
+def shrink(case, candidates=None):
+    """ Shrink a failing case to a smaller one which still fails, returning
+        the smallest case found and its mismatch.
+    """
+    mismatch = run_case(case, candidates)
+    assert mismatch is not None, "Only a failing case can be shrunk"
+    # Nothing after the step which failed is needed.
+    tape = normalise(case.replace(case.tape[:mismatch.step + 1])).tape
+
+    def attempt(new_tape):
+        return run_case(case.replace(new_tape), candidates)
+
+    improved = True
+    while improved:
+        improved = False
+        # Remove chunks of the tape, halving the size of the chunks.
+        size = len(tape) // 2
+        while size:
+            start = 0
+            while start < len(tape):
+                new_tape = tape[:start] + tape[start + size:]
+                found = attempt(new_tape)
+                if found is not None:
+                    tape, mismatch, improved = new_tape, found, True
+                else:
+                    start += size
+            size //= 2
+        # Lower each number, trying the smallest first.
+        for index, number in enumerate(tape):
+            for smaller in sorted({0, number // 2, number - 1}):
+                if smaller >= number:
+                    continue
+                new_tape = tape[:index] + [smaller] + tape[index + 1:]
+                found = attempt(new_tape)
+                if found is not None:
+                    tape, mismatch, improved = new_tape, found, True
+                    break
+    return normalise(case.replace(tape[:mismatch.step + 1])), mismatch
+
+
+def describe(case):
+    """ The moves tried by the case, one per line, as played by the reference
+        engine, with the exception any illegal move raised.
+    """
+    game = case.new_game()
+    lines = []
+    for number in case.tape:
+        if game.is_game_finished():
+            break
+        move, _, _ = pick(game, number)
+        line = move.to_log_string()
+        try:
+            game.play_move(move)
+        except Exception as exception:
+            line += '  # {0}'.format(type(exception).__name__)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def fuzz(num_cases, seed=None, candidates=None):
+    """ Run the given number of cases generated from the seed, yielding each
+    failing case, shrunk, and its mismatch.
+    """
+    rng = random.Random(seed)
+    for _ in range(num_cases):
+        case = Case.generate(rng)
+        if run_case(case, candidates) is not None:
+            yield shrink(case, candidates)
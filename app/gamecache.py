@@ -0,0 +1,135 @@
+"""A cache of game snapshots which may be shared between worker processes.
+
+Restoring a game from its log means replaying every move, so a game that is
+being played is restored over and over by whichever worker process serves
+each request. Instead the latest snapshot of each game, see
+`Game.checkpoint`, is cached along with the game's version. A snapshot is
+only returned for the version it was taken at, so a worker never sees a
+stale game, and storing a newer version replaces it.
+
+`DirectoryCache` stores each snapshot as a file, so that processes on the
+same host share it when the directory is on a memory backed file system such
+as /dev/shm. `MemoryCache` is a stand-in with the same interface, holding the
+snapshots within a single process, which is used when no directory is
+configured and in tests. Either holds up to `max_size` snapshots, evicting
+the least recently used, or for a directory the least recently stored.
+"""
+
+import itertools
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    """ Snapshots held in this process, when full the least recently used is
+        evicted.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, game_id, version):
+        with self.lock:
+            entry = self.entries.get(game_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(game_id)
+            return json.loads(entry[1])
+
+    def set(self, game_id, version, snapshot):
+        data = json.dumps(snapshot)
+        with self.lock:
+            self.entries[game_id] = (version, data)
+            self.entries.move_to_end(game_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, game_id):
+        with self.lock:
+            self.entries.pop(game_id, None)
+
+
+class DirectoryCache(object):
+    """ Snapshots stored as a file per game in the given directory. A file is
+    replaced by renaming a complete file over it, so that readers in other
+    processes never see a partly written snapshot.
+
+    Listing the directory on every store would be costly, so it is pruned
+    back to `max_size` files, dropping the oldest by modification time, only
+    once every `prune_interval` stores by this process.
+    """
+    def __init__(self, directory, max_size=1024, prune_interval=None):
+        self.directory = directory
+        self.max_size = max_size
+        if prune_interval is None:
+            prune_interval = max(1, max_size // 16)
+        self.prune_interval = prune_interval
+        self.stores = itertools.count(1)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, game_id):
+        return os.path.join(self.directory, '{0}.json'.format(game_id))
+
+    def get(self, game_id, version):
+        try:
+            with open(self.path(game_id)) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if entry['version'] != version:
+            return None
+        return entry['snapshot']
+
+    def set(self, game_id, version, snapshot):
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as cache_file:
+                json.dump({'version': version, 'snapshot': snapshot},
+                          cache_file)
+            os.replace(temporary, self.path(game_id))
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+        if next(self.stores) % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """ Remove the oldest snapshots beyond `max_size`."""
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    # Removed by another process.
+                    continue
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_size]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, game_id):
+        try:
+            os.remove(self.path(game_id))
+        except OSError:
+            pass
+
+
+def create_cache(directory=None, max_size=1024):
+    """ A cache shared through the given directory, or if there is none, one
+        held in this process.
+    """
+    if directory is None:
+        return MemoryCache(max_size=max_size)
+    return DirectoryCache(directory, max_size=max_size)
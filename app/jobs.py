@@ -0,0 +1,123 @@
+"""A small queue of jobs run in the background by a pool of worker threads.
+
+Work which need not hold up the response to a request, such as archiving a
+game once it has finished, is enqueued after the request's transaction is
+committed and run by one of a fixed number of workers, which bounds how many
+jobs run at once. A job which raises an exception is retried after a delay
+which doubles with each attempt, up to a maximum number of attempts.
+
+The queue is held in memory, so jobs still queued when the process exits are
+lost. Jobs should therefore be work that can be redone later in bulk, as the
+`manage.py archive` command does for archival.
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = 0
+
+    def __repr__(self):
+        return '<Job {0}{1}>'.format(self.function.__name__, self.args)
+
+
+class JobQueue(object):
+    """ Jobs are run by `workers` threads, started on the first job enqueued.
+    With no workers jobs are held until `join` is called, and then run by the
+    thread calling it, which is convenient for tests and scripts. Each job is
+    run within the context manager returned by `context`, if given, for
+    example an application context.
+    """
+    def __init__(self, workers=2, max_attempts=3, retry_delay=1.0,
+                 context=None):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.context = context
+        self.failed = []
+        self._queue = queue.Queue()
+        self._threads = []
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def enqueue(self, function, *args, **kwargs):
+        with self._condition:
+            self._pending += 1
+            if self.workers and not self._threads:
+                self._start()
+        self._queue.put(Job(function, args, kwargs))
+
+    def _start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True,
+                                      name='job-worker-{0}'.format(number))
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if self._run(job):
+                self._done()
+            else:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                timer = threading.Timer(delay, self._queue.put, [job])
+                timer.daemon = True
+                timer.start()
+
+    def _run(self, job):
+        """ Run the job, returning False if it failed and should be retried.
+        """
+        job.attempts += 1
+        try:
+            if self.context is None:
+                job.function(*job.args, **job.kwargs)
+            else:
+                with self.context():
+                    job.function(*job.args, **job.kwargs)
+        except Exception as exception:
+            if job.attempts < self.max_attempts:
+                logger.warning("%r failed, attempt %d of %d", job,
+                               job.attempts, self.max_attempts)
+                return False
+            logger.exception("%r failed, giving up", job)
+            self.failed.append((job, exception))
+        return True
+
+    def _done(self):
+        with self._condition:
+            self._pending -= 1
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """ Wait until every job enqueued has succeeded or been given up on,
+            returning False if the timeout expired first.
+        """
+        if not self.workers:
+            while not self._queue.empty():
+                job = self._queue.get()
+                while not self._run(job):
+                    pass
+                self._done()
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0,
+                                            timeout=timeout)
+
+    def stop(self):
+        """ Stop the workers once the jobs already queued have been run."""
+        with self._condition:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,149 @@
+"""Opt-in timing of the hot paths of a request.
+
+Timings are recorded into histograms keyed by the route being served and
+the phase of work being timed, for example the replay of a game's log or the
+rendering of a template. Nothing is recorded unless `enable` has been called,
+and while disabled the timers cost no more than a global lookup.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+enabled = False
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = OrderedDict()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+class Histogram(object):
+    """A cumulative histogram of durations, in seconds."""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+def current_route():
+    return getattr(_local, 'route', None) or 'none'
+
+
+def set_route(route):
+    _local.route = route
+
+
+def observe(phase, seconds):
+    key = (current_route(), phase)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def _timer(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+@contextmanager
+def _null_timer():
+    yield
+
+
+def timer(phase):
+    """ A context manager timing the phase of work done within it."""
+    return _timer(phase) if enabled else _null_timer()
+
+
+def timed(phase):
+    """ A decorator timing every call of the decorated function."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _timer(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(phase, iterable):
+    """ Time the work done in producing each item of the given iterable, which
+        is returned unchanged while timing is disabled.
+    """
+    if not enabled:
+        return iterable
+    return _timed_iter(phase, iter(iterable))
+
+
+def _timed_iter(phase, iterator):
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        observe(phase, elapsed)
+
+
+def render_text(prefix='loveletter'):
+    """ Render the histograms in the Prometheus text exposition format."""
+    name = '{0}_phase_seconds'.format(prefix)
+    lines = ['# HELP {0} Time spent in each phase of a request.'.format(name),
+             '# TYPE {0} histogram'.format(name)]
+    with _lock:
+        histograms = [(key, h.counts.copy(), h.count, h.sum)
+                      for key, h in _histograms.items()]
+    for (route, phase), counts, count, total in histograms:
+        labels = 'route="{0}",phase="{1}"'.format(route, phase)
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                name, labels, bound, cumulative))
+        lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(name, labels,
+                                                              count))
+        lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, total))
+        lines.append('{0}_count{{{1}}} {2}'.format(name, labels, count))
+    return "\n".join(lines) + "\n"
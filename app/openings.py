@@ -0,0 +1,233 @@
+"""A precomputed table of the expected value of each opening move.
+
+The first move of a game is made knowing only the two cards in the first
+player's hand and the number of players, so there are few enough opening
+positions to evaluate them all ahead of time. `build_table` estimates the
+value of each move available in each of them by Monte Carlo: it deals many
+games consistent with the position, plays the move in each, and plays the
+rest of the game out at random, see `rollout`. Every move of a position is
+tried on the same deals, so that the differences between the moves are not
+swamped by the luck of the deal. The value of a move is the first player's
+expected share of the win, counting a tie between two players as half a win.
+
+The table is stored as a flat array of 16 bit values after a short header,
+one for each possible move code, see `Move.encode`, of each position, so
+that `OpeningTable` can map the file into memory and read any one value
+with a single computed offset rather than loading or searching anything.
+"""
+
+import mmap
+import os
+import random
+import struct
+import tempfile
+
+from app.engine import (
+    CARD_CODES, Card, Game, MAX_PLAYERS, MIN_PLAYERS, card_pack_for,
+    player_names)
+
+MAGIC = b'LLOPEN01'
+# The magic, the smallest and largest number of players and the number of
+# rollouts each value was estimated from.
+HEADER = struct.Struct('<8sHHI')
+VALUE = struct.Struct('<H')
+
+# Values are stored as a fraction of SCALE, UNKNOWN marks moves which are not
+# available, or positions which cannot arise.
+SCALE = 0xfffe
+UNKNOWN = 0xffff
+
+NUM_CARDS = len(Card)
+# The unordered pairs of cards a hand may hold.
+NUM_HANDS = NUM_CARDS * (NUM_CARDS + 1) // 2
+# Every move code, see `Move.encode`, is less than this.
+NUM_CODES = CARD_CODES * CARD_CODES * (MAX_PLAYERS + 1)
+
+
+def hand_index(card_one, card_two):
+    """ The index of the hand holding the two cards, in either order."""
+    low, high = sorted([int(card_one), int(card_two)])
+    return (high - 1) * high // 2 + low - 1
+
+
+def position_offset(num_players, card_one, card_two):
+    """ The index of the first value of the given opening position."""
+    position = ((num_players - MIN_PLAYERS) * NUM_HANDS +
+                hand_index(card_one, card_two))
+    return position * NUM_CODES
+
+
+def seat_order(game):
+    """ The players from the one whose turn it is, in the order they play.
+        This is the list moves are encoded against.
+    """
+    return [game.on_turn[0]] + game.players
+
+
+def is_opening(game):
+    return game.on_turn is not None and game.num_moves == 0
+
+
+def rollout(game, rng):
+    """ Play the game out with random moves. Each player picks one of their
+    two cards at random and then one of its moves, but never discards the
+    princess if they have a choice. Returns the winners.
+    """
+    while not game.is_game_finished():
+        choices = [pmoves for pmoves in game.available_moves()
+                   if pmoves.moves]
+        if len(choices) > 1:
+            choices = [pmoves for pmoves in choices
+                       if pmoves.card != Card.princess] or choices
+        game.play_move(rng.choice(rng.choice(choices).moves))
+    return game.winners
+
+
+def opening_deals(num_players, card_one, card_two, rng):
+    """ Endlessly deal packs, as the deck and discarded card for a `Game`, in
+    which the first player is dealt one of the given cards and draws the
+    other. Returns None if the pack does not hold both cards.
+    """
+    rest = card_pack_for(num_players)
+    for card in [card_one, card_two]:
+        if card not in rest:
+            return None
+        rest.remove(card)
+
+    def deals():
+        while True:
+            rng.shuffle(rest)
+            discarded, others = rest[0], rest[1:]
+            deck = ([card_one] + others[:num_players - 1] + [card_two] +
+                    others[num_players - 1:])
+            yield deck, discarded
+    return deals()
+
+
+def evaluate_opening(num_players, card_one, card_two, samples, rng):
+    """ The estimated value of each move available to the first player
+        holding the given cards, by move code. This is empty if no such hand
+        can be dealt.
+    """
+    deals = opening_deals(num_players, card_one, card_two, rng)
+    if deals is None:
+        return dict()
+    players = player_names(num_players)
+    first = players[0]
+    totals = dict()
+    for _ in range(samples):
+        deck, discarded = next(deals)
+        seed = rng.getrandbits(64)
+        game = Game(players.copy(), deck=deck, discarded=discarded)
+        # A hand of two of the same card offers each move twice.
+        moves = {move.encode(players): move
+                 for pmoves in game.available_moves()
+                 for move in pmoves.moves}
+        for code, move in moves.items():
+            game = Game(players.copy(), deck=deck, discarded=discarded)
+            game.play_move(move)
+            winners = rollout(game, random.Random(seed))
+            share = 1 / len(winners) if first in winners else 0
+            totals[code] = totals.get(code, 0) + share
+    return {code: total / samples for code, total in totals.items()}
+
+
+def build_table(samples, rng=None, progress=None):
+    """ The opening table, as bytes, estimating each value from the given
+    number of rollouts. Calls `progress(num_players, card_one, card_two)`,
+    if given, before evaluating each position.
+    """
+    if rng is None:
+        rng = random.Random()
+    num_positions = (MAX_PLAYERS - MIN_PLAYERS + 1) * NUM_HANDS
+    values = [UNKNOWN] * (num_positions * NUM_CODES)
+    for num_players in range(MIN_PLAYERS, MAX_PLAYERS + 1):
+        for card_two in Card:
+            for card_one in Card:
+                if card_one > card_two:
+                    continue
+                if progress is not None:
+                    progress(num_players, card_one, card_two)
+                offset = position_offset(num_players, card_one, card_two)
+                estimates = evaluate_opening(num_players, card_one, card_two,
+                                             samples, rng)
+                for code, value in estimates.items():
+                    values[offset + code] = round(value * SCALE)
+    header = HEADER.pack(MAGIC, MIN_PLAYERS, MAX_PLAYERS, samples)
+    return header + struct.pack('<{0}H'.format(len(values)), *values)
+
+
+def write_table(path, data):
+    """ Replace the table at the given path, such that a process mapping the
+        old table keeps reading it unchanged.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as output:
+        output.write(data)
+    os.replace(output.name, path)
+
+
+class OpeningTable(object):
+    """ The opening table held in the given buffer, usually a file mapped
+        into memory by `load`.
+    """
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise ValueError("Not an opening table")
+        magic, min_players, max_players, samples = HEADER.unpack_from(buffer)
+        expected_size = HEADER.size + VALUE.size * NUM_CODES * NUM_HANDS * (
+            MAX_PLAYERS - MIN_PLAYERS + 1)
+        if (magic != MAGIC or min_players != MIN_PLAYERS or
+                max_players != MAX_PLAYERS or len(buffer) != expected_size):
+            raise ValueError("Not an opening table for this version")
+        self.buffer = buffer
+        self.samples = samples
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as table_file:
+            buffer = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def value(self, num_players, card_one, card_two, code):
+        """ The expected value of the move with the given code for the first
+            player holding the given cards, or None if it is not known.
+        """
+        if not (MIN_PLAYERS <= num_players <= MAX_PLAYERS and
+                0 <= code < NUM_CODES):
+            return None
+        offset = position_offset(num_players, card_one, card_two) + code
+        value, = VALUE.unpack_from(self.buffer,
+                                   HEADER.size + VALUE.size * offset)
+        return None if value == UNKNOWN else value / SCALE
+
+    def move_values(self, game):
+        """ The available moves of a game yet to have its first move played,
+            each paired with its expected value. This is empty for any other
+            game, or if the values are not known.
+        """
+        if not is_opening(game):
+            return []
+        players = seat_order(game)
+        _, card_one, card_two = game.on_turn
+        values = []
+        for pmoves in game.available_moves():
+            for move in pmoves.moves:
+                value = self.value(len(players), card_one, card_two,
+                                   move.encode(players))
+                if value is not None:
+                    values.append((move, value))
+        return values
+
+    def best_move(self, game):
+        """ The opening move with the highest expected value, or None if the
+            game is not at its opening or the values are not known.
+        """
+        values = self.move_values(game)
+        if not values:
+            return None
+        return max(values, key=lambda move_value: move_value[1])[0]
@@ -0,0 +1,123 @@
+"""Counting of the SQL statements issued while serving a request.
+
+This is meant for development and staging. Whilst a `QueryLog` is active
+for the current thread every statement executed is recorded together with
+its duration and the place in our code it was issued from. This lets us
+report statements slower than a threshold, and statements repeated within a
+single request, which is usually the sign of an N+1 pattern such as lazily
+loading a relationship in a loop.
+"""
+
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+import sqlalchemy
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_this_file = os.path.abspath(__file__)
+_app_directory = os.path.dirname(_this_file)
+
+Statement = namedtuple('Statement', ['statement', 'parameters', 'duration',
+                                     'call_site'])
+
+
+def call_site():
+    """ The innermost frame of our own code in the current stack, formatted
+        as 'file:line in function'.
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame[0])
+        if filename.startswith(_app_directory) and filename != _this_file:
+            return '{0}:{1} in {2}'.format(os.path.basename(frame[0]),
+                                           frame[1], frame[2])
+    return 'unknown'
+
+
+class QueryLog(object):
+    """ The statements executed whilst the log is active for this thread."""
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.statements = []
+
+    def record(self, statement, parameters, duration):
+        site = call_site()
+        self.statements.append(Statement(statement, parameters, duration,
+                                         site))
+        if self.slow_threshold is not None and duration > self.slow_threshold:
+            logger.warning("Slow query (%.3fs) at %s: %s", duration, site,
+                           statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def repeated(self, threshold=2):
+        """ The statements executed at least `threshold` times, each with the
+            number of times and the call sites it was executed from.
+        """
+        counts = Counter(s.statement for s in self.statements)
+        repeats = []
+        for statement, count in counts.most_common():
+            if count < threshold:
+                break
+            sites = sorted({s.call_site for s in self.statements
+                            if s.statement == statement})
+            repeats.append((statement, count, sites))
+        return repeats
+
+    def report(self, name, repeat_threshold):
+        logger.debug("%s executed %d statements", name, len(self))
+        for statement, count, sites in self.repeated(repeat_threshold):
+            logger.warning("Possible N+1 in %s, executed %d times from %s: %s",
+                           name, count, ", ".join(sites), statement)
+
+
+def current():
+    return getattr(_local, 'log', None)
+
+
+def start(slow_threshold=None):
+    _local.log = QueryLog(slow_threshold=slow_threshold)
+    return _local.log
+
+
+def stop():
+    log = current()
+    _local.log = None
+    return log
+
+
+@contextmanager
+def capture(slow_threshold=None):
+    """ Record the statements executed within the block, restoring any log
+        that was already active afterwards.
+    """
+    outer = current()
+    log = start(slow_threshold=slow_threshold)
+    try:
+        yield log
+    finally:
+        _local.log = outer
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine,
+                              'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    if current() is not None:
+        conn.info.setdefault('querylog_start_times', []).append(
+            time.perf_counter())
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    start_times = conn.info.get('querylog_start_times')
+    log = current()
+    if start_times and log is not None:
+        duration = time.perf_counter() - start_times.pop()
+        log.record(statement, parameters, duration)
@@ -0,0 +1,48 @@
+"""Token bucket rate limiting of requests, held in memory.
+
+Each client, identified by a key such as its secret or address, has a bucket
+holding up to `burst` tokens which refills at `rate` tokens a second. Every
+request takes a token, and a request finding the bucket empty is refused
+and told how long until a token is available. A bucket left untouched long
+enough to refill is the same as no bucket at all, so such buckets are swept
+away from time to time and the store does not grow with every client ever
+seen.
+"""
+
+import threading
+import time
+
+
+class RateLimiter(object):
+    def __init__(self, rate, burst, sweep_interval=60):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self.buckets = dict()
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def acquire(self, key):
+        """ Take a token from the key's bucket, returning 0 if there was one,
+            and otherwise the number of seconds until there will be.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_sweep > self.sweep_interval:
+                self.sweep(now)
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+    def sweep(self, now):
+        """ Forget the buckets which have refilled. Must be called with the
+            lock held.
+        """
+        refill_time = self.burst / self.rate
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if now - bucket[1] < refill_time}
+        self.last_sweep = now
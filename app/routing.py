@@ -0,0 +1,232 @@
+"""Routing of the requests for each game to the worker which owns it.
+
+The in-process state kept for a game, such as its cached snapshot, version
+and rendered fragments, is only of use if the requests for that game keep
+landing on the same worker. `HashRing` maps game ids to workers with
+consistent hashing: each worker is placed at many points around a ring of
+hashes and a game belongs to the first worker after the hash of its id. So
+when a worker joins or leaves only the games nearest to its points move, the
+rest keep their owner.
+
+`Router` is a small WSGI application to run in front of the workers, which
+forwards each request to the owner of the game in its path, and any other
+request to any worker. The matchmaking tickets are also kept in a worker's
+memory, so every matchmaking request goes to the one worker owning them. A
+worker which cannot be reached is taken off the ring, and its games move to
+the remaining workers, until it answers again. It is probed for that every
+`retry_interval` seconds, by the next request to arrive. A worker which was
+sent the request but failed to answer it, say by taking too long, may still
+have acted on it, so the request is not sent to another worker but answered
+with an error, and the worker keeps its place.
+"""
+
+import bisect
+import hashlib
+import http.client
+import logging
+import random
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# The paths which name a game, with the game's id as the first group.
+GAME_PATH = re.compile(
+    r'^/(?:viewgame|playcard|joingame|updateprofile|api/game)/(\d+)')
+# The paths of the matchmaking queue, all of which are owned by a single
+# worker, the owner of MATCHMAKING_KEY.
+MATCHMAKING_PATH = re.compile(r'^/matchmaking(?:/|$)')
+MATCHMAKING_KEY = 'matchmaking'
+
+# The errors of a worker which fails to answer a request, or a probe. A
+# worker which could not be sent the request gives a URLError. Timeouts and
+# dropped connections after the request was sent give the others.
+FAILED_ERRORS = (OSError, http.client.HTTPException)
+
+# Headers which only apply to a single connection, so are not forwarded.
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate',
+                      'proxy-authorization', 'te', 'trailers',
+                      'transfer-encoding', 'upgrade'}
+
+
+def ring_hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """ A consistent hash ring of nodes, each placed at `replicas` points so
+        that the keys are spread evenly between them.
+    """
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.points = []
+        self.owners = dict()
+        self.lock = threading.Lock()
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted(set(self.owners.values()))
+
+    def add(self, node):
+        with self.lock:
+            for replica in range(self.replicas):
+                point = ring_hash('{0}#{1}'.format(node, replica))
+                if point not in self.owners:
+                    bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node):
+        with self.lock:
+            points = [p for p, owner in self.owners.items() if owner == node]
+            for point in points:
+                del self.owners[point]
+            self.points = sorted(self.owners)
+
+    def node_for(self, key):
+        """ The node owning the given key, or None if there are no nodes."""
+        with self.lock:
+            if not self.points:
+                return None
+            index = bisect.bisect(self.points, ring_hash(str(key)))
+            return self.owners[self.points[index % len(self.points)]]
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    """ Redirects are passed back to the client rather than followed."""
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Router(object):
+    """ A WSGI application forwarding requests to the given workers, each
+        given by its base url, for example 'http://127.0.0.1:5001'.
+    """
+    def __init__(self, nodes, replicas=100, timeout=10, retry_interval=30):
+        self.ring = HashRing(nodes, replicas=replicas)
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.opener = urllib.request.build_opener(NoRedirects)
+        # The workers taken off the ring, each with the time from which it
+        # is next to be probed.
+        self.down = dict()
+        self.lock = threading.Lock()
+
+    def node_for(self, path):
+        match = GAME_PATH.match(path)
+        if match is not None:
+            return self.ring.node_for(match.group(1))
+        if MATCHMAKING_PATH.match(path):
+            return self.ring.node_for(MATCHMAKING_KEY)
+        nodes = self.ring.nodes
+        return random.choice(nodes) if nodes else None
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else None
+        self.probe_down_nodes()
+        node = self.node_for(path)
+        while node is not None:
+            try:
+                status, headers, content = self.forward(node, environ, body)
+            except urllib.error.URLError as error:
+                logger.warning("Removing unreachable worker %s: %s", node,
+                               error.reason)
+                self.take_down(node)
+                node = self.node_for(path)
+                continue
+            except FAILED_ERRORS as error:
+                logger.warning("Worker %s failed to answer %s %s: %r", node,
+                               environ['REQUEST_METHOD'], path, error)
+                if isinstance(error, socket.timeout):
+                    status = '504 Gateway Timeout'
+                else:
+                    status = '502 Bad Gateway'
+                start_response(status, [('Content-Type', 'text/plain')])
+                return [b'The worker failed to answer']
+            start_response(status, headers)
+            return [content]
+        start_response('502 Bad Gateway', [('Content-Type', 'text/plain')])
+        return [b'No workers available']
+
+    def forward(self, node, environ, body):
+        url = node + environ.get('PATH_INFO', '/')
+        if environ.get('QUERY_STRING'):
+            url += '?' + environ['QUERY_STRING']
+        request = urllib.request.Request(url, data=body,
+                                         method=environ['REQUEST_METHOD'])
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').title()
+                if name.lower() not in HOP_BY_HOP_HEADERS:
+                    request.add_header(name, value)
+        if environ.get('CONTENT_TYPE'):
+            request.add_header('Content-Type', environ['CONTENT_TYPE'])
+        try:
+            response = self.opener.open(request, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            # Error statuses, redirects and 304s are still responses.
+            response = error
+        with response:
+            content = response.read()
+            status = '{0} {1}'.format(response.code, response.reason)
+            headers = [(name, value)
+                       for name, value in response.headers.items()
+                       if name.lower() not in HOP_BY_HOP_HEADERS]
+        return status, headers, content
+
+    def is_reachable(self, node):
+        try:
+            with self.opener.open(node + '/', timeout=self.timeout):
+                return True
+        except urllib.error.HTTPError:
+            # Any response at all shows the worker is up.
+            return True
+        except FAILED_ERRORS:
+            return False
+
+    def take_down(self, node):
+        """ Take an unreachable worker off the ring until it answers again.
+        """
+        self.ring.remove(node)
+        with self.lock:
+            self.down[node] = time.monotonic() + self.retry_interval
+
+    def probe_down_nodes(self):
+        """ Put back on the ring the workers taken down which are due to be
+            probed and answer. Each is claimed for the next interval before it
+            is probed, so that concurrent requests do not probe it as well.
+        """
+        now = time.monotonic()
+        with self.lock:
+            due = [node for node, retry_at in self.down.items()
+                   if retry_at <= now]
+            for node in due:
+                self.down[node] = now + self.retry_interval
+        for node in due:
+            if not self.is_reachable(node):
+                continue
+            with self.lock:
+                # Unless it was removed for good in the meantime.
+                revived = self.down.pop(node, None) is not None
+            if revived:
+                logger.info("Worker %s is reachable again", node)
+                self.ring.add(node)
+
+    def add_node(self, node):
+        """ Add a worker, taking over its share of the games."""
+        with self.lock:
+            self.down.pop(node, None)
+        self.ring.add(node)
+
+    def remove_node(self, node):
+        """ Remove a worker, its games move to the remaining workers."""
+        with self.lock:
+            self.down.pop(node, None)
+        self.ring.remove(node)
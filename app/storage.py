@@ -0,0 +1,164 @@
+"""Where the games, and the profiles of their players, are kept.
+
+The routes and background jobs reach the games through the application's
+storage, see `app.main.storage`, rather than the database session, so that
+they may be run against something other than the database. A storage has
+these methods:
+
+`get_game(game_no)`
+    The game in play, or waiting for players, to be changed, or None.
+`find_game(game_no, reader=False)`
+    The game to be read, which may have been archived, or None. A reader
+    may be served by a replica, so may not see the latest changes.
+`find_games(game_ids)` and `latest_checkpoints(game_ids)`
+    The games with the given ids, by id, found as by `find_game` for a
+    reader, and the latest checkpoint of each of them in play, see
+    `DBGame.load_game`.
+`find_view(game_no, viewer)`
+    The stored `DBGameView` of the game for the viewer, or None.
+`open_games()`
+    The games still waiting for players.
+`find_profile(profile_id)` and `premove_profiles(db_game)`
+    A profile by id, and the profiles of the game's players who have
+    pending pre-moves.
+`add_game(db_game)` and `add_profile(profile)`
+    Store a new game, along with its players, or a new profile of a player
+    of a stored game. Either is given its id at once.
+`keyed_game(key, window)` and `store_keyed_game(key, db_game)`
+    The game started with the given idempotency key within the last
+    `window` seconds, if it is still open, and record that the given newly
+    added game was started with the key, committing it. Should two requests
+    race to start a game with the same key, both are given the game of the
+    first, which `store_keyed_game` returns.
+`claim_turn(db_game, deadline)`
+    Take the turn of the game which timed out at the given deadline, by
+    clearing the stored deadline if it is still that one, and return whether
+    it was. Of the processes racing to play a timed out turn only one takes
+    it.
+`archive(db_games)`
+    Move finished games into the archive, where `find_game` still finds
+    them.
+`commit()` and `rollback()`
+    End the transaction of changes made to the games and profiles. Only
+    `SQLStorage` can undo changes, see below.
+
+`app.main.SQLStorage` keeps them in the database. It lives beside the models
+and sessions it queries, since `app.main` imports this module. `MemoryStorage`
+is a stand-in with the same interface which holds the very same model objects
+in this process, never added to a database session, for tests, simulations
+and load tests which need not pay for the database. Its changes take effect
+as they are made, to the objects themselves, so there is no transaction to
+roll back: `rollback` leaves every change in place. The callers only roll
+back after a database error, which it never raises. It is also only safe for
+a single process.
+"""
+
+import itertools
+import threading
+import time
+
+
+class MemoryStorage(object):
+    """ The games and profiles held in this process."""
+    def __init__(self):
+        self.games = dict()
+        self.archived = dict()
+        self.profiles = dict()
+        self.keys = dict()
+        self.game_ids = itertools.count(1)
+        self.last_game_id = 0
+        self.profile_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def get_game(self, game_no):
+        return self.games.get(game_no)
+
+    def find_game(self, game_no, reader=False):
+        db_game = self.games.get(game_no)
+        return self.archived.get(game_no) if db_game is None else db_game
+
+    def find_games(self, game_ids):
+        db_games = {game_id: self.find_game(game_id) for game_id in game_ids}
+        return {game_id: db_game for game_id, db_game in db_games.items()
+                if db_game is not None}
+
+    def latest_checkpoints(self, game_ids):
+        # Games are never replayed from a checkpoint here, the snapshot
+        # cache holds the latest state of each game.
+        return dict()
+
+    def find_view(self, game_no, viewer):
+        db_game = self.games.get(game_no)
+        if db_game is None:
+            return None
+        return next((view for view in db_game.views
+                     if view.viewer == viewer), None)
+
+    def open_games(self):
+        return [db_game for _, db_game in sorted(self.games.items())
+                if not db_game.game_started]
+
+    def find_profile(self, profile_id):
+        return self.profiles.get(profile_id)
+
+    def premove_profiles(self, db_game):
+        return [profile for profile in db_game.players if profile.premoves]
+
+    def add_game(self, db_game):
+        with self.lock:
+            db_game.id = self.last_game_id = next(self.game_ids)
+            self.games[db_game.id] = db_game
+        for profile in db_game.players:
+            profile.game_id = db_game.id
+            self.add_profile(profile)
+
+    def add_profile(self, profile):
+        with self.lock:
+            profile.id = next(self.profile_ids)
+            self.profiles[profile.id] = profile
+
+    def keyed_game(self, key, window):
+        game_id, created, _ = self.keys.get(key, (None, 0, 0))
+        db_game = self.games.get(game_id)
+        if (db_game is not None and time.time() - created < window and
+                not db_game.game_started):
+            return db_game
+        return None
+
+    def store_keyed_game(self, key, db_game):
+        """ Each key records the last game added when it was stored. A key
+            stored since the given game was added, so since its request
+            looked the key up, was stored by a racing request. The racing
+            request's game is then given instead, and the given game dropped,
+            just as the database does.
+        """
+        with self.lock:
+            game_id, _, last_game_id = self.keys.get(key, (None, 0, 0))
+            if last_game_id >= db_game.id and game_id in self.games:
+                del self.games[db_game.id]
+                return self.games[game_id]
+            self.keys[key] = (db_game.id, time.time(), self.last_game_id)
+        return db_game
+
+    def claim_turn(self, db_game, deadline):
+        with self.lock:
+            if db_game.turn_deadline != deadline:
+                return False
+            db_game.turn_deadline = None
+            return True
+
+    def archive(self, db_games):
+        with self.lock:
+            for db_game in db_games:
+                self.archived[db_game.id] = self.games.pop(db_game.id)
+                for profile in db_game.players:
+                    self.profiles.pop(profile.id, None)
+            game_ids = {db_game.id for db_game in db_games}
+            self.keys = {key: value for key, value in self.keys.items()
+                         if value[0] not in game_ids}
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
@@ -12,8 +12,6 @@ import manage
 # selenium debug lines from flooding the test output
 logging.disable(logging.CRITICAL)
 
-from app.main import application
-
 
 class PhantomTest(unittest.TestCase):
 
@@ -38,7 +36,7 @@ class PhantomTest(unittest.TestCase):
             return 1
 
     def _spawn_live_server(self):
-        self.port = application.config['LIVE_SERVER_PORT']
+        self.port = manage.application.config['LIVE_SERVER_PORT']
         self._server_url = 'http://localhost:{}'.format(self.port)
         command_line = 'python manage.py run_test_server'
         self._process = subprocess.Popen(shlex.split(command_line))
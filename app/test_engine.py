@@ -0,0 +1,762 @@
+"""Tests of the rules of the game, see `app.engine`."""
+
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from app import fuzz, openings
+from app.engine import (
+    Card, CountessForcedException, Game, MAX_PLAYERS, MIN_PLAYERS, Move,
+    PreMove, card_pack_for, decode_move, find_premove, iter_log_lines,
+    parse_log_entry, player_names)
+
+
+class GameTest(unittest.TestCase):
+    def test_guard_wins(self):
+        """ In this test we check that a player with a guard can knock out
+            the other players. This will be more or less the shortest game
+            possible in which player 1 knocks out player 2, player 3 knocks
+            out player 4 and then player 1 again knocks out player 2.
+        """
+        # We set the deck so that we know what comes next.
+        deck = [Card.guard,  # Player 1's dealt card.
+                Card.priest,  # Player 2's dealt card, which p1 will guess.
+                Card.guard,  # Player 3's dealt card.
+                Card.priest,  # Player 4's dealt card which p3 will guess.
+                Card.guard,  # Player 1's drawn card.
+                Card.baron,  # Player 3's drawn card which p1 will guess and win
+                Card.baron  # Player 1 still needs to draw a card.
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,1,b,2')
+        game.play_turn('c,1,d,2')
+        game.play_turn('a,1,c,3')
+        self.assertEqual(game.players, ['a'])
+        expected_log = ("a:1\nb:2\nc:1\nd:2\na:1\na,1,b,2\nb-2\nc:3\nc,1,d,2\n"
+                        "d-2\na:3\na,1,c,3\nc-3")
+        self.assertEqual(game.serialise_game(), expected_log)
+        # Now we do an expected log for each player.
+        expected_log = ("a:1\nb:?\nc:?\nd:?\na:1\na,1,b,2\nb-2\nc:?\nc,1,d,2\n"
+                        "d-2\na:3\na,1,c,3\nc-3")
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = ("a:?\nb:2\nc:?\nd:?\na:?\na,1,b,2\nb-2\nc:?\nc,1,d,2\n"
+                        "d-2\na:?\na,1,c,3\nc-3")
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = ("a:?\nb:?\nc:1\nd:?\na:?\na,1,b,2\nb-2\nc:3\nc,1,d,2\n"
+                        "d-2\na:?\na,1,c,3\nc-3")
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = ("a:?\nb:?\nc:?\nd:2\na:?\na,1,b,2\nb-2\nc:?\nc,1,d,2\n"
+                        "d-2\na:?\na,1,c,3\nc-3")
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_priest(self):
+        """ Priests do not really affect the game state, all it means is that
+        one player now knows what another player currently holds. However we
+        can check the log is correctly updated with this information, since the
+        log will be shown to each player.
+        """
+        deck = [Card.priest,  # Player 1's dealt card
+                Card.countess,  # Player 2's dealt card
+                Card.guard,  # Player 3's dealt card
+                Card.king,  # Player 4's dealt card
+                Card.guard,  # Player 1's drawn card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,2,b,')
+        self.assertEqual(game.players, ['b', 'c', 'd', 'a'])
+        expected_log = "a:2\nb:7\nc:1\nd:6\na:1\na,2,b,\nb;a;7"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:2\nb:?\nc:?\nd:?\na:1\na,2,b,\nb;a;7"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:7\nc:?\nd:?\na:?\na,2,b,\nb;a;7"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:1\nd:?\na:?\na,2,b,\nb;a;?"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:6\na:?\na,2,b,\nb;a;?"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_baron(self):
+        """ This simply tests that the baron can knock a player out. We check
+            also that a baron-tie causes no changes. We should of course also
+            check that handmaid makes this card essentially a simple discard.
+        """
+        deck = [Card.baron,  # player a is dealt this card
+                Card.priest,  # player b is dealt this card
+                Card.baron,  # player c is dealt this card
+                Card.countess,  # player d is dealt this card
+                Card.prince,  # a draws prince, higher than b's priest
+                Card.prince,  # c draws prince, lower than d's countess.
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,3,b,')
+        game.play_turn('c,3,d,')
+        self.assertEqual(game.players, ['d', 'a'])
+        expected_log = "a:3\nb:2\nc:3\nd:7\na:5\na,3,b,\nb-2\nc:5\nc,3,d,\nc-5"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:3\nb:?\nc:?\nd:?\na:5\na,3,b,\nb-2\nc:?\nc,3,d,\nc-5"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:2\nc:?\nd:?\na:?\na,3,b,\nb-2\nc:?\nc,3,d,\nc-5"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:3\nd:?\na:?\na,3,b,\nb-2\nc:5\nc,3,d,\nc-5"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:7\na:?\na,3,b,\nb-2\nc:?\nc,3,d,\nc-5"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+        deck = [Card.baron,  # player a is dealt this card
+                Card.priest,  # player b is dealt this card
+                Card.baron,  # player c is dealt this card
+                Card.prince,  # player d is dealt this card
+                Card.prince,  # a draws prince, higher than b's priest,
+                              # but the same as d's prince.
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,3,d,')
+        # Both a and d still in the game due to the drawn baron showdown.
+        self.assertEqual(game.players, ['b', 'c', 'd', 'a'])
+        expected_log = "a:3\nb:2\nc:3\nd:5\na:5\na,3,d,"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:3\nb:?\nc:?\nd:?\na:5\na,3,d,"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:2\nc:?\nd:?\na:?\na,3,d,"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:3\nd:?\na:?\na,3,d,"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:5\na:?\na,3,d,"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_handmaid(self):
+        """ There is actually no real test to do on the handmaid, if the
+            front-end does not allow invalid moves then we should never
+            apply another card to a player protected by a handmaid. Here
+            we mostly just make sure that the correct players are protected
+            under a handmaid and that we raise an exception if we attempt to
+            play another card against a handmaid.
+        """
+        deck = [Card.handmaid,  # player a is dealt this card
+                Card.baron,  # player b is dealt this card
+                Card.guard,  # player c is dealt this card
+                Card.countess,  # player d is dealt this card
+                Card.prince,  # a draws this card
+                Card.prince,  # b draws this card
+                Card.guard,  # d draws this card.
+                Card.guard,  # a draws a guard
+                Card.handmaid,  # d draws a handmaid
+                Card.king,  # a draws a king
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,4,,')
+        self.assertEqual(set(['a']), game.handmaided)
+        # Assert that 'b' cannot baron 'a'
+        with self.assertRaises(Exception):
+            game.play_turn('b,3,a,')
+        # But they can baron 'c' and will win as prince > guard
+        game.play_turn('b,3,c,')
+        self.assertEqual(['d', 'a', 'b'], game.live_players())
+        # a is still handmaided
+        self.assertEqual(set(['a']), game.handmaided)
+        # 'd' draws and plays the guard and kills b
+        game.play_turn('d,1,b,5')
+        self.assertEqual(['a', 'd'], game.live_players())
+        # 'a' draws and plays a guard, but does not manage to kill 'd' we check
+        # that 'a' is no longer handmaided
+        game.play_turn('a,1,d,8')
+        self.assertEqual(set(), game.handmaided)
+        # 'd' draws and plays a handmaid
+        game.play_turn('d,4,,')
+        self.assertIn('d', game.handmaided)
+        # 'a' draws a king, and plays it but it has no effect because 'd',
+        # the only other player, is handmaided. Here we show that attempting to
+        # king 'd' results in an exception so instead we king None.
+        with self.assertRaises(Exception):
+            game.play_turn('a,6,d,')
+        game.play_turn('a,6,,')
+        # We check the state of the game is as we expect:
+        self.assertEqual(['d', 'a'], game.players)
+        self.assertEqual(Card.prince, game.hands['a'])
+        self.assertEqual(Card.countess, game.hands['d'])
+        expected_log = ("a:4\nb:3\nc:1\nd:7\na:5\na,4,,\nb:5\nb,3,c,\nc-1\n"
+                        "d:1\nd,1,b,5\nb-5\na:1\na,1,d,8\nd:4\nd,4,,\na:6\n"
+                        "a,6,,")
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = ("a:4\nb:?\nc:?\nd:?\na:5\na,4,,\nb:?\nb,3,c,\nc-1\n"
+                        "d:?\nd,1,b,5\nb-5\na:1\na,1,d,8\nd:?\nd,4,,\na:6\n"
+                        "a,6,,")
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = ("a:?\nb:3\nc:?\nd:?\na:?\na,4,,\nb:5\nb,3,c,\nc-1\n"
+                        "d:?\nd,1,b,5\nb-5\na:?\na,1,d,8\nd:?\nd,4,,\na:?\n"
+                        "a,6,,")
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = ("a:?\nb:?\nc:1\nd:?\na:?\na,4,,\nb:?\nb,3,c,\nc-1\n"
+                        "d:?\nd,1,b,5\nb-5\na:?\na,1,d,8\nd:?\nd,4,,\na:?\n"
+                        "a,6,,")
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = ("a:?\nb:?\nc:?\nd:7\na:?\na,4,,\nb:?\nb,3,c,\nc-1\n"
+                        "d:1\nd,1,b,5\nb-5\na:?\na,1,d,8\nd:4\nd,4,,\na:?\n"
+                        "a,6,,")
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_prince(self):
+        """ This tests the prince has the desired effect, we will also check
+            that you can prince yourself.
+        """
+        deck = [Card.prince,  # player a is dealt this card
+                Card.guard,  # player b is dealt this card
+                Card.prince,  # player c is dealt this card
+                Card.guard,  # player d is dealt this card
+                Card.guard,  # player a draws this card
+                Card.princess,  # player b draws this when princed by 'a'
+                Card.countess,  # player b draws this card on their turn
+                Card.handmaid,  # player c draws this card on their turn
+                Card.king  # player c princes themselves and draws this card.
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,5,b,')
+        # Assert that 'b' now has the princess not the guard they were dealt.
+        self.assertEqual(game.hands['b'], Card.princess)
+        game.play_turn('b,7,,')
+
+        # c draws a card and we check that they are able to prince themselves.
+        game.play_turn('c,5,c,')
+        # So now 'b' should still have the princess and 'c' should have a king.
+        self.assertEqual(game.hands['b'], Card.princess)
+        self.assertEqual(game.hands['c'], Card.king)
+        self.assertEqual(game.players, ['d', 'a', 'b', 'c'])
+        expected_log = ("a:5\nb:1\nc:5\nd:1\na:1\na,5,b,\nb-1\nb:8\nb:7\n"
+                        "b,7,,\nc:4\nc,5,c,\nc-4\nc:6")
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = ("a:5\nb:?\nc:?\nd:?\na:1\na,5,b,\nb-1\nb:?\nb:?\n"
+                        "b,7,,\nc:?\nc,5,c,\nc-4\nc:?")
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = ("a:?\nb:1\nc:?\nd:?\na:?\na,5,b,\nb-1\nb:8\nb:7\n"
+                        "b,7,,\nc:?\nc,5,c,\nc-4\nc:?")
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = ("a:?\nb:?\nc:5\nd:?\na:?\na,5,b,\nb-1\nb:?\nb:?\n"
+                        "b,7,,\nc:4\nc,5,c,\nc-4\nc:6")
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = ("a:?\nb:?\nc:?\nd:1\na:?\na,5,b,\nb-1\nb:?\nb:?\n"
+                        "b,7,,\nc:?\nc,5,c,\nc-4\nc:?")
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+        # In another test we make sure that if you attempt to prince someone
+        # on the last turn, when there are no cards left we make sure that the
+        # card to be taken by the player is the originally discarded card
+        # meaning the card discarded from the deck to make sure there is not
+        # total knowledge.
+        deck = [Card.prince,  # player a is dealt this card
+                Card.guard,  # player b is dealt this card
+                Card.prince,  # player c is dealt this card
+                Card.guard,  # player d is dealt this card
+                Card.guard,  # player a draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck, discarded=Card.princess)
+        game.play_turn('a,5,b,')
+        self.assertEqual(game.hands['b'], Card.princess)
+        expected_log = "a:5\nb:1\nc:5\nd:1\na:1\na,5,b,\nb-1\nb:8"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:5\nb:?\nc:?\nd:?\na:1\na,5,b,\nb-1\nb:?"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:1\nc:?\nd:?\na:?\na,5,b,\nb-1\nb:8"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:5\nd:?\na:?\na,5,b,\nb-1\nb:?"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:1\na:?\na,5,b,\nb-1\nb:?"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_king(self):
+        deck = [Card.king,  # player a is dealt this card
+                Card.guard,  # player b is dealt this card
+                Card.prince,  # player c is dealt this card
+                Card.princess,  # player d is dealt this card
+                Card.guard,  # player a draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,6,d,')
+        self.assertEqual(game.hands['a'], Card.princess)
+        self.assertEqual(game.hands['d'], Card.guard)
+        expected_log = "a:6\nb:1\nc:5\nd:8\na:1\na,6,d,"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:6\nb:?\nc:?\nd:?\na:1\na,6,d,"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:1\nc:?\nd:?\na:?\na,6,d,"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:5\nd:?\na:?\na,6,d,"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:8\na:?\na,6,d,"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def check_handmaid_discard(self, discard):
+        """ For the cards guard, priest, baron, and king if all other players
+            are handmaided then you are able to simply discard the card. This
+            checks that that is indeed possible.
+        """
+        deck = [Card.handmaid,  # player a is dealt this card.
+                Card.handmaid,  # player b dealt
+                Card.handmaid,  # player c dealt
+                discard,  # player d dealt
+                Card.guard,  # player a draws this card
+                Card.guard,  # player b draws this card
+                Card.guard,  # player c draws this card
+                Card.princess,  # player d draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        game.play_turn('a,4,,')
+        game.play_turn('b,4,,')
+        game.play_turn('c,4,,')
+        # Before we play it as a discard we attempt to play it properly against
+        # a handmaided opponent, which should raise an error:
+        with self.assertRaises(Exception):
+            game.play_turn('d,{0},a,'.format(str(discard.value)))
+
+        game.play_turn('d,{0},,'.format(str(discard.value)))
+        self.assertEqual(['a', 'b', 'c', 'd'], game.players)
+        expected_log = ("a:4\nb:4\nc:4\nd:{0}\na:1\na,4,,\nb:1\nb,4,,\nc:1\n"
+                        "c,4,,\nd:8\nd,{0},,").format(str(discard.value))
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = ("a:4\nb:?\nc:?\nd:?\na:1\na,4,,\nb:?\nb,4,,\nc:?\n"
+                        "c,4,,\nd:?\nd,{0},,").format(str(discard.value))
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = ("a:?\nb:4\nc:?\nd:?\na:?\na,4,,\nb:1\nb,4,,\nc:?\n"
+                        "c,4,,\nd:?\nd,{0},,").format(str(discard.value))
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = ("a:?\nb:?\nc:4\nd:?\na:?\na,4,,\nb:?\nb,4,,\nc:1\n"
+                        "c,4,,\nd:?\nd,{0},,").format(str(discard.value))
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = ("a:?\nb:?\nc:?\nd:{0}\na:?\na,4,,\nb:?\nb,4,,\nc:?\n"
+                        "c,4,,\nd:8\nd,{0},,").format(str(discard.value))
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_handmaid_dicard(self):
+        for card in [Card.guard, Card.priest, Card.baron, Card.king]:
+            self.check_handmaid_discard(card)
+
+    def check_countess(self, prince_or_king):
+        """ A very basic test that having the prince or the king in a player's
+            hand together with the countess forces that player to discard the
+            countess.
+        """
+        self.assertIn(prince_or_king, [Card.prince, Card.king])
+        deck = [Card.countess,  # player a is dealt this card.
+                Card.guard,  # player b dealt
+                Card.guard,  # player c dealt
+                Card.baron,  # player d dealt
+                prince_or_king  # player a draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        # Player a draws a prince/king and attempts to play it, but cannot
+        # because they have the countess.
+        with self.assertRaises(CountessForcedException):
+            game.play_turn('a,{0},d,'.format(str(prince_or_king.value)))
+        # So they instead discard the countess
+        game.play_turn('a,7,,')
+        self.assertEqual(game.hands['a'], prince_or_king)
+        self.assertEqual(['b', 'c', 'd', 'a'], game.players)
+        expected_log = ("a:7\nb:1\nc:1\nd:3\na:{0}\n"
+                        "a,7,,").format(str(prince_or_king.value))
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = ("a:7\nb:?\nc:?\nd:?\na:{0}\n"
+                        "a,7,,").format(str(prince_or_king.value))
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:1\nc:?\nd:?\na:?\na,7,,"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:1\nd:?\na:?\na,7,,"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:3\na:?\na,7,,"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+    def test_countess(self):
+        self.check_countess(Card.prince)
+        self.check_countess(Card.king)
+
+    def test_find_premove(self):
+        deck = [Card.guard,  # player a is dealt this card
+                Card.priest,  # player b is dealt this card
+                Card.guard,  # player a draws this card
+                Card.baron,  # player b draws this card
+                ]
+        game = Game(['a', 'b'], deck=deck, discarded=Card.princess)
+        guess = Move('a', Card.guard, nominated_player='b',
+                     nominated_card=Card.priest)
+        premoves = [PreMove(None, Move('b', Card.priest,
+                                       nominated_player='a')),
+                    PreMove(Card.baron, guess),
+                    PreMove(None, Move('a', Card.priest,
+                                       nominated_player='b')),
+                    PreMove(Card.guard, guess)]
+        # Only the last is a's, for the card a drew, and available to them.
+        self.assertEqual(find_premove(game, premoves), 3)
+        self.assertIsNone(find_premove(game, premoves[:3]))
+        game.play_move(guess)
+        self.assertTrue(game.is_game_finished())
+
+    def test_move_codes(self):
+        players = player_names(4)
+        game = Game(players.copy())
+        for possible in game.available_moves():
+            for move in possible.moves:
+                decoded = decode_move(move.player, move.encode(players),
+                                      players)
+                self.assertEqual(decoded.to_log_string(),
+                                 move.to_log_string())
+
+    def test_princess(self):
+        deck = [Card.princess,  # player a is dealt this card
+                Card.guard,  # player b is dealt this card
+                Card.prince,  # player c dealt
+                Card.guard,  # player d
+                Card.baron,  # player a draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        # The simplest case, player 'a' is dealt the princess and discards it
+        # immediately, it might be that we should stop someone doing something
+        # obviously stupid, but for now we just follow the rules:
+        game = Game(players, deck=deck)
+        game.play_turn('a,8,,')
+        self.assertNotIn('a', game.players)
+        expected_log = "a:8\nb:1\nc:5\nd:1\na:3\na,8,,"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:8\nb:?\nc:?\nd:?\na:3\na,8,,"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:1\nc:?\nd:?\na:?\na,8,,"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:5\nd:?\na:?\na,8,,"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:1\na:?\na,8,,"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+        # Now we do a more interesting example in which a player is forced to
+        # discard the princess via a prince card.
+        deck = [Card.prince,  # player a is dealt this card
+                Card.guard,  # player b is dealt this card
+                Card.princess,  # player c dealt
+                Card.guard,  # player d
+                Card.baron,  # player a draws this card
+                ]
+        players = ['a', 'b', 'c', 'd']
+        game = Game(players, deck=deck)
+        # So player 'a' princes player 'c' and forces them to discard the
+        # princess
+        game.play_turn('a,5,c,')
+        self.assertNotIn('c', game.players)
+        self.assertIn('c', game.out_players)
+        expected_log = "a:5\nb:1\nc:8\nd:1\na:3\na,5,c,\nc-8"
+        self.assertEqual(game.serialise_game(), expected_log)
+        expected_log = "a:5\nb:?\nc:?\nd:?\na:3\na,5,c,\nc-8"
+        self.assertEqual(game.serialise_game(player='a'), expected_log)
+        expected_log = "a:?\nb:1\nc:?\nd:?\na:?\na,5,c,\nc-8"
+        self.assertEqual(game.serialise_game(player='b'), expected_log)
+        expected_log = "a:?\nb:?\nc:8\nd:?\na:?\na,5,c,\nc-8"
+        self.assertEqual(game.serialise_game(player='c'), expected_log)
+        expected_log = "a:?\nb:?\nc:?\nd:1\na:?\na,5,c,\nc-8"
+        self.assertEqual(game.serialise_game(player='d'), expected_log)
+
+
+class SelfConsistency(unittest.TestCase):
+    """ In this test class we simply run several iterations of the game and
+        we should get no exceptions being raised for illegal moves because
+        we should only be choosing from those we are given.
+        We also check that the game can loaded from a log and you get the same
+        result as before you serialised the game.
+    """
+    def play_test_game(self, limit=100, num_players=4):
+        players = player_names(num_players)
+        game = Game(players)
+        for _ in range(limit):
+            if game.is_game_finished():
+                break
+            pmoves_one, pmoves_two = game.available_moves()
+            possible_moves = pmoves_one.moves + pmoves_two.moves
+            game.play_move(random.choice(possible_moves))
+        return game
+
+    def test_game(self):
+        for num_players in range(MIN_PLAYERS, MAX_PLAYERS + 1):
+            for _ in range(100):
+                self.play_test_game(num_players=num_players)
+
+    def test_load(self):
+        for num_players in range(MIN_PLAYERS, MAX_PLAYERS + 1):
+            for _ in range(100):
+                self.check_load(num_players)
+
+    def check_load(self, num_players):
+        # Note that the initial deal is not actually counted in the
+        # limit of the moves so some games will have a high enough limit
+        # to finish the game. There would be some that did anyway on
+        # account of finishing through all but one player being out.
+        limit = random.choice(range(len(card_pack_for(num_players))))
+        game_one = self.play_test_game(limit=limit, num_players=num_players)
+        log = game_one.serialise_game()
+        players = player_names(num_players)
+        try:
+            game_two = Game(players, log=log)
+        except Exception as e:
+            print(log)
+            raise e
+        self.assertEqual(game_one.players, game_two.players)
+        self.assertEqual(game_one.hands, game_two.hands)
+        self.assertEqual(game_one.winners, game_two.winners)
+
+    def test_streaming_sources(self):
+        """ The log may be given as a string, as bytes, as chunks of either
+            which split lines, or as the rows of a database cursor, all of
+            which should restore the same game.
+        """
+        game = self.play_test_game(limit=5)
+        log = game.serialise_game()
+        data = log.encode('utf-8')
+        players = player_names(4)
+        sources = [log, data,
+                   io.StringIO(log),
+                   [log[i:i + 7] for i in range(0, len(log), 7)],
+                   [data[i:i + 5] for i in range(0, len(data), 5)],
+                   [line + "\n" for line in log.split("\n")] + [""],
+                   [log.rstrip("\n"), ""],
+                   [(line,) for line in log.split("\n")],
+                   [(log,)]]
+        for source in sources:
+            game_two = Game(players.copy(), log=source)
+            self.assertEqual(game.serialise_game(), game_two.serialise_game())
+            self.assertEqual(game.hands, game_two.hands)
+
+    def test_log_chunk_boundaries(self):
+        """ Chunks of a log which end exactly at a newline, which are empty,
+            or whose last line has no newline should give the same lines as
+            the whole log.
+        """
+        lines = ['a:1', 'b:2', 'c:3']
+        sources = [['a:1\n', 'b:2\n', 'c:3\n'],
+                   ['a:1', '\n', 'b:2', '\n', 'c:3'],
+                   ['a:1\nb:2\n', 'c:3'],
+                   ['a:1\nb:2\nc:3', ''],
+                   ['a:1\nb:2\nc:3\n', ''],
+                   ['', 'a:1\n', '', 'b:', '', '2\nc:3', '', ''],
+                   [b'a:1\n', b'b:2\n', b'c:3'],
+                   [b'a:1\nb:', b'', b'2\nc:3', b''],
+                   ['a:1\n', ('b:2\n',), 'c:3', '']]
+        for source in sources:
+            self.assertEqual(list(iter_log_lines(source)), lines, source)
+        self.assertEqual(list(iter_log_lines([])), [])
+        self.assertEqual(list(iter_log_lines(['', b''])), [])
+        self.assertEqual(list(iter_log_lines(['a:1'])), ['a:1'])
+        self.assertEqual(list(iter_log_lines(['a:1', ''])), ['a:1'])
+        # A multi-byte character split between chunks is only decoded once
+        # its line is whole.
+        data = 'n:é\n'.encode('utf-8')
+        self.assertEqual(list(iter_log_lines([data[:3], data[3:], b''])),
+                         ['n:é'])
+
+    def test_replay_prefix(self):
+        """ Replaying only the first few moves of a log should give the same
+            game as it was after those moves were played.
+        """
+        for _ in range(20):
+            game = Game(player_names(4))
+            states = [(game.serialise_game(), game.players.copy())]
+            while not game.is_game_finished():
+                pmoves_one, pmoves_two = game.available_moves()
+                game.play_move(random.choice(pmoves_one.moves +
+                                             pmoves_two.moves))
+                states.append((game.serialise_game(), game.players.copy()))
+            log = game.serialise_game()
+            for moves, (prefix_log, players) in enumerate(states):
+                game_two = Game(player_names(4), log=log, moves=moves)
+                self.assertEqual(game_two.num_moves, moves)
+                self.assertEqual(game_two.serialise_game(), prefix_log)
+                self.assertEqual(game_two.players, players)
+
+    def test_checkpoints(self):
+        """ Restoring a game from a checkpoint and replaying the rest of the
+            log should give the same game as replaying the whole log.
+        """
+        for num_players in [2, 4, 6]:
+            for _ in range(20):
+                game = self.play_test_game(num_players=num_players)
+                log = game.serialise_game()
+                checkpoints = [None]
+                for moves in range(1, game.num_moves + 1):
+                    game_two = Game(player_names(num_players), log=log,
+                                    moves=moves)
+                    checkpoint = json.loads(json.dumps(game_two.checkpoint()))
+                    checkpoints.append(checkpoint)
+                for moves in range(game.num_moves + 1):
+                    expected = Game(player_names(num_players), log=log,
+                                    moves=moves)
+                    for checkpoint in checkpoints[:moves + 1]:
+                        restored = Game(player_names(num_players), log=log,
+                                        moves=moves, checkpoint=checkpoint)
+                        self.assertEqual(restored.serialise_game(),
+                                         expected.serialise_game())
+                        self.assertEqual(restored.checkpoint(),
+                                         expected.checkpoint())
+                        self.assertEqual(len(restored.deck),
+                                         len(expected.deck))
+
+    def test_long_player_names(self):
+        """ Player names are not restricted to a single character, so check
+            that a game between named players survives a round trip through
+            the log.
+        """
+        deck = [Card.guard,  # alice is dealt this card
+                Card.priest,  # bob is dealt this card, which alice guesses
+                Card.baron,  # alice draws this card
+                ]
+        game = Game(['alice', 'bob'], deck=deck)
+        game.play_turn('alice,1,bob,2')
+        self.assertTrue(game.is_game_finished())
+        self.assertEqual(game.winners, {'alice'})
+        log = game.serialise_game()
+        self.assertEqual(log, "alice:1\nbob:2\nalice:3\nalice,1,bob,2\nbob-2")
+        game_two = Game(['alice', 'bob'], log=log)
+        self.assertEqual(game_two.winners, {'alice'})
+        self.assertEqual(game_two.hands, game.hands)
+
+
+class ForgetfulEngine(fuzz.ReplayEngine):
+    """ A broken candidate which forgets who is protected by a handmaid."""
+    def current(self):
+        game = super().current()
+        game.handmaided = set()
+        return game
+
+
+class FuzzTest(unittest.TestCase):
+    def test_engines_agree(self):
+        failures = list(fuzz.fuzz(100, seed=0))
+        self.assertEqual(failures, [])
+
+    def test_illegal_moves_refused(self):
+        """ The illegal moves tried are refused with the expected exceptions,
+            and each kind of illegal move is tried.
+        """
+        rng = random.Random(0)
+        refused = set()
+        for _ in range(50):
+            case = fuzz.Case.generate(rng)
+            game = case.new_game()
+            for number in case.tape:
+                if game.is_game_finished():
+                    break
+                move, must_raise, _ = fuzz.pick(game, number)
+                if must_raise is None:
+                    game.play_move(move)
+                else:
+                    self.assertRaises(must_raise, game.play_move, move)
+                    refused.add(must_raise)
+        self.assertEqual(len(refused), 3)
+
+    def test_shrink(self):
+        candidates = {'forgetful': ForgetfulEngine}
+        case, mismatch = next(fuzz.fuzz(20, seed=0, candidates=candidates))
+        self.assertEqual(mismatch.engine, 'forgetful')
+        self.assertEqual(mismatch.field, 'checkpoint')
+        # The shrunk case still fails, it ends with a handmaid being played,
+        # and survives a round trip through its JSON form.
+        case = fuzz.Case.from_json(case.to_json())
+        self.assertEqual(fuzz.run_case(case, candidates), mismatch)
+        self.assertEqual(fuzz.run_case(case), None)
+        last_move = fuzz.describe(case).splitlines()[-1]
+        self.assertEqual(parse_log_entry(last_move).card, Card.handmaid)
+
+
+class ImportTimeTest(unittest.TestCase):
+    # The longest, in seconds, importing the engine may take.
+    IMPORT_BUDGET = 0.25
+    # Modules the engine must not import, being slow to import and needed only
+    # by the web application or the tests.
+    HEAVY_MODULES = ['flask', 'sqlalchemy', 'wtforms', 'unittest']
+
+    def test_import_time(self):
+        """ Import the engine in a fresh interpreter, so that nothing it
+            imports is already loaded.
+        """
+        script = ("import sys, time\n"
+                  "start = time.perf_counter()\n"
+                  "import app.engine\n"
+                  "print(time.perf_counter() - start)\n"
+                  "print(' '.join(sorted(sys.modules)))\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=root, universal_newlines=True)
+        seconds, modules = output.splitlines()
+        modules = modules.split()
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+        self.assertLess(float(seconds), self.IMPORT_BUDGET)
+
+
+class OpeningsTest(unittest.TestCase):
+    def test_hand_index(self):
+        indices = {openings.hand_index(one, two)
+                   for one in Card for two in Card}
+        self.assertEqual(indices, set(range(openings.NUM_HANDS)))
+        self.assertEqual(openings.hand_index(Card.guard, Card.princess),
+                         openings.hand_index(Card.princess, Card.guard))
+
+    def test_evaluate_opening(self):
+        rng = random.Random(0)
+        # There is only one princess in a pack for two players.
+        self.assertEqual(openings.evaluate_opening(
+            2, Card.princess, Card.princess, 10, rng), dict())
+        values = openings.evaluate_opening(2, Card.guard, Card.princess, 20,
+                                           rng)
+        players = player_names(2)
+        game = Game(players.copy(), deck=[Card.guard, Card.priest,
+                                          Card.princess])
+        codes = {move.encode(players) for pmoves in game.available_moves()
+                 for move in pmoves.moves}
+        self.assertEqual(set(values), codes)
+        self.assertTrue(all(0 <= value <= 1 for value in values.values()))
+        # Discarding the princess always loses.
+        self.assertEqual(values[Move('a', Card.princess).encode(players)], 0)
+
+    def test_table(self):
+        players = player_names(3)
+        deck = [Card.guard, Card.priest, Card.baron, Card.princess,
+                Card.handmaid]
+        game = Game(players.copy(), deck=deck, discarded=Card.king)
+        best = Move('a', Card.guard, nominated_player='c',
+                    nominated_card=Card.baron)
+        princess = Move('a', Card.princess)
+        size = (openings.NUM_HANDS * openings.NUM_CODES *
+                (MAX_PLAYERS - MIN_PLAYERS + 1))
+        values = [openings.UNKNOWN] * size
+        offset = openings.position_offset(3, Card.princess, Card.guard)
+        values[offset + best.encode(players)] = openings.SCALE
+        values[offset + princess.encode(players)] = openings.SCALE // 2
+        data = openings.HEADER.pack(openings.MAGIC, MIN_PLAYERS, MAX_PLAYERS,
+                                    1) + b''.join(openings.VALUE.pack(value)
+                                                  for value in values)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openings.bin')
+            openings.write_table(path, data)
+            table = openings.OpeningTable.load(path)
+            try:
+                self.assertEqual(table.value(3, Card.guard, Card.princess,
+                                             best.encode(players)), 1)
+                self.assertAlmostEqual(
+                    table.value(3, Card.princess, Card.guard,
+                                princess.encode(players)), 0.5, places=4)
+                self.assertIsNone(table.value(4, Card.guard, Card.princess,
+                                              best.encode(players)))
+                self.assertEqual(len(table.move_values(game)), 2)
+                self.assertEqual(table.best_move(game).to_log_string(),
+                                 best.to_log_string())
+                game.play_move(best)
+                self.assertIsNone(table.best_move(game))
+            finally:
+                table.close()
+        self.assertRaises(ValueError, openings.OpeningTable, data[:-2])
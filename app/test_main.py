@@ -0,0 +1,1307 @@
+"""Tests of the web application, see `app.main`."""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from flask import url_for
+import sqlalchemy
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from app import (
+    gamecache, jobs, metrics, openings, querylog, ratelimit, routing, timers,
+    tokens, verify)
+from app.engine import (
+    MAX_PLAYERS, MIN_PLAYERS, RECORD_FIELDS, Card, Game, Move, count_moves,
+    player_names)
+from app.main import (
+    ArchivedGame, Configuration, DBCheckpoint, DBGame, DBGameView,
+    DBLightProfile, ReaderSessions, archive_finished_games, create_app,
+    database, import_game_records, iter_game_logs, iter_game_records,
+    iter_stored_games, job_queue, load_turn_deadlines, matchmaker,
+    play_timed_out_turn, storage, turn_timer, viewgame_limiter)
+from app.storage import MemoryStorage
+
+application = create_app()
+
+
+class RouteTest(unittest.TestCase):
+    """ A base class for tests of the routes, run against a fresh in-memory
+        database.
+    """
+    def setUp(self):
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        application.config['TESTING'] = True
+        application.config['WTF_CSRF_ENABLED'] = False
+        application.extensions['game_cache'] = gamecache.MemoryCache()
+        self.app_context = application.app_context()
+        self.app_context.push()
+        database.create_all()
+        self.client = application.test_client()
+
+    def tearDown(self):
+        database.session.remove()
+        database.drop_all()
+        self.app_context.pop()
+
+    def start_game(self, num_players=4):
+        """ Start a game and have every player join, returns the game's id
+            and the viewgame url for each player.
+        """
+        response = self.client.get('/startgame?players={0}'.format(
+            num_players))
+        game_no = int(response.headers['Location'].rsplit('/', 1)[-1])
+        urls = dict()
+        for player in player_names(num_players):
+            response = self.client.get('/joingame/{0}/{1}'.format(game_no,
+                                                                  player))
+            urls[player] = response.headers['Location']
+        return game_no, urls
+
+    @contextmanager
+    def assertMaxQueries(self, maximum):
+        """ Assert that at most `maximum` statements are executed within the
+            block.
+        """
+        with querylog.capture() as log:
+            yield log
+        if len(log) > maximum:
+            statements = "\n".join("{0} ({1})".format(s.statement, s.call_site)
+                                   for s in log.statements)
+            self.fail("{0} statements executed, expected at most {1}:\n{2}"
+                      .format(len(log), maximum, statements))
+
+    def playcard_url(self, game_no, viewgame_url, move):
+        """ The url to play the given move, for the player viewing the game
+            at the given url.
+        """
+        token = viewgame_url.rsplit('/', 1)[-1]
+        with application.test_request_context():
+            return url_for('main.playcard', game_no=game_no, token=token,
+                           card=move.card, nom_player=move.nominated_player,
+                           nom_card=move.nominated_card)
+
+    def play_to_finish(self, game_no, urls):
+        """ Play random moves, as the players viewing the game at the given
+            urls, until the game is finished.
+        """
+        while True:
+            game = storage().get_game(game_no).load_game()
+            if game.is_game_finished():
+                return
+            pmoves_one, pmoves_two = game.available_moves()
+            self.client.get(self.playcard_url(
+                game_no, urls[game.on_turn[0]],
+                random.choice(pmoves_one.moves + pmoves_two.moves)))
+            database.session.expire_all()
+
+
+class ViewGameCacheTest(RouteTest):
+    def test_not_modified(self):
+        game_no, urls = self.start_game()
+        url = '/viewgame/{0}'.format(game_no)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag, _ = response.get_etag()
+        self.assertIsNotNone(etag)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Once a move has been played the page must be rendered again.
+        db_game = database.session.query(DBGame).get(game_no)
+        game = db_game.load_game()
+        player = game.on_turn[0]
+        moves = game.available_moves()
+        move = (moves[0].moves + moves[1].moves)[0]
+        self.client.get(self.playcard_url(game_no, urls[player], move))
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+
+class GameViewTest(RouteTest):
+    def test_views_follow_game(self):
+        """ The stored views agree with the game after every move, and with
+            the views built from the game itself.
+        """
+        game_no, urls = self.start_game(num_players=3)
+        for _ in range(4):
+            db_game = database.session.query(DBGame).get(game_no)
+            game = db_game.load_game()
+            views = {view.viewer: view for view in db_game.views}
+            self.assertEqual(sorted(views), ['', 'a', 'b', 'c'])
+            for viewer, view in views.items():
+                built = db_game.build_view(viewer)
+                for column in DBGameView.__table__.columns.keys():
+                    self.assertEqual(getattr(view, column),
+                                     getattr(built, column))
+                log = [entry.to_log_string()
+                       for entry in game.log_for_player(viewer)]
+                self.assertEqual(view.log_lines(), log)
+                self.assertEqual(view.version, db_game.version)
+            if game.is_game_finished():
+                break
+            pmoves_one, pmoves_two = game.available_moves()
+            self.assertEqual(
+                [[m.to_log_string() for m in p.moves]
+                 for p in views[game.on_turn[0]].possible_moves()],
+                [[m.to_log_string() for m in p.moves]
+                 for p in (pmoves_one, pmoves_two)])
+            self.client.get(self.playcard_url(
+                game_no, urls[game.on_turn[0]],
+                random.choice(pmoves_one.moves + pmoves_two.moves)))
+            database.session.expire_all()
+
+    def test_game_without_views(self):
+        """ A game stored before there were views is viewed from the game,
+            and given views when it next changes.
+        """
+        game_no, urls = self.start_game(num_players=2)
+        before = self.client.get(urls['a'])
+        database.session.query(DBGameView).delete()
+        database.session.commit()
+        after = self.client.get(urls['a'])
+        self.assertEqual(after.data, before.data)
+
+        db_game = database.session.query(DBGame).get(game_no)
+        db_game.bump_version()
+        db_game.refresh_views()
+        database.session.commit()
+        self.assertEqual(
+            {(view.viewer, view.nickname) for view in db_game.views},
+            {('', None), ('a', 'a'), ('b', 'b')})
+
+
+class ApiTest(RouteTest):
+    def get_json(self, url):
+        response = self.client.get(url)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def post_json(self, url, data):
+        response = self.client.post(url, data=json.dumps(data),
+                                    content_type='application/json')
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_play_game(self):
+        """ Play a whole game through the API, choosing from the moves it says
+            are available.
+        """
+        game_no, urls = self.start_game(num_players=3)
+        signed = {p: url.rsplit('/', 1)[-1] for p, url in urls.items()}
+        status, state = self.get_json('/api/game/{0}'.format(game_no))
+        self.assertEqual(status, 200)
+        self.assertTrue(state['started'])
+        self.assertNotIn(':1', state['log'].replace(':?', ''))
+        while not state['finished']:
+            player = state['on_turn']
+            prefix = '/api/game/{0}/{1}'.format(game_no, signed[player])
+            status, moves = self.get_json(prefix + '/moves')
+            self.assertEqual(status, 200)
+            self.assertTrue(moves['moves'])
+            # Nobody else may play in the meantime.
+            other = next(p for p in signed if p != player)
+            status, _ = self.post_json('/api/game/{0}/{1}/move'.format(
+                game_no, signed[other]), {'move': moves['moves'][0]})
+            self.assertEqual(status, 409)
+            status, state = self.post_json(prefix + '/move',
+                                           {'move': random.choice(
+                                               moves['moves'])})
+            self.assertEqual(status, 200)
+        self.assertTrue(state['winners'])
+
+        requested = [{'game': game_no, 'token': signed['a']},
+                     {'game': game_no},
+                     {'game': game_no + 1}]
+        status, batch = self.post_json('/api/games', {'games': requested})
+        self.assertEqual(status, 200)
+        self.assertEqual(batch['games'][0]['you'], 'a')
+        self.assertIsNone(batch['games'][1]['you'])
+        self.assertIn('error', batch['games'][2])
+
+    def test_move_not_a_code(self):
+        """ A move must be given by its code, not by anything equal to it. """
+        game_no, urls = self.start_game(num_players=2)
+        signed = {p: url.rsplit('/', 1)[-1] for p, url in urls.items()}
+        _, state = self.get_json('/api/game/{0}'.format(game_no))
+        prefix = '/api/game/{0}/{1}'.format(game_no, signed[state['on_turn']])
+        _, moves = self.get_json(prefix + '/moves')
+        code = moves['moves'][0]
+        for move in [float(code), str(code), True, None, [code]]:
+            status, _ = self.post_json(prefix + '/move', {'move': move})
+            self.assertEqual(status, 400)
+        status, _ = self.post_json(prefix + '/move', {'move': code})
+        self.assertEqual(status, 200)
+
+    def test_opening_hint(self):
+        """ With every opening move valued the same, the hint is the first
+            available move, and there is no hint after the first move.
+        """
+        size = (openings.NUM_HANDS * openings.NUM_CODES *
+                (MAX_PLAYERS - MIN_PLAYERS + 1))
+        data = openings.HEADER.pack(openings.MAGIC, MIN_PLAYERS, MAX_PLAYERS,
+                                    1) + openings.VALUE.pack(1) * size
+        application.extensions['opening_table'] = openings.OpeningTable(data)
+        self.addCleanup(application.extensions.__setitem__, 'opening_table',
+                        None)
+        game_no, urls = self.start_game(num_players=3)
+        signed = {p: url.rsplit('/', 1)[-1] for p, url in urls.items()}
+        prefix = '/api/game/{0}/{1}'.format(game_no, signed['a'])
+        status, moves = self.get_json(prefix + '/moves')
+        self.assertEqual(moves['hint'], moves['moves'][0])
+        status, state = self.post_json(prefix + '/move',
+                                       {'move': moves['hint']})
+        self.assertEqual(status, 200)
+        if not state['finished']:
+            player = state['on_turn']
+            status, moves = self.get_json('/api/game/{0}/{1}/moves'.format(
+                game_no, signed[player]))
+            self.assertIsNone(moves['hint'])
+
+    def test_premoves(self):
+        """ A pre-move is played as soon as its player's turn comes. """
+        game_no, urls = self.start_game(num_players=2)
+        signed = {p: url.rsplit('/', 1)[-1] for p, url in urls.items()}
+        # Deal a guard to a, who has drawn another, and a priest to b.
+        db_game = storage().get_game(game_no)
+        db_game.state_log = "a:1\nb:2\na:1"
+        storage().commit()
+        application.extensions['game_cache'].delete(game_no)
+
+        players = db_game.gamenames
+        priest = Move('b', Card.priest, nominated_player='a')
+        guard = Move('a', Card.guard, nominated_player='b',
+                     nominated_card=Card.princess)
+        requested = [{'drawn': Card.countess, 'move': priest.encode(players)},
+                     {'drawn': None, 'move': priest.encode(players)}]
+        prefix = '/api/game/{0}/{1}'.format(game_no, signed['b'])
+        status, state = self.post_json(prefix + '/premoves',
+                                       {'premoves': requested})
+        self.assertEqual(status, 200)
+        self.assertEqual(state['premoves'], requested)
+        status, _ = self.post_json(prefix + '/premoves',
+                                   {'premoves': [{'move': 'x'}]})
+        self.assertEqual(status, 400)
+
+        status, state = self.post_json(
+            '/api/game/{0}/{1}/move'.format(game_no, signed['a']),
+            {'move': guard.encode(players)})
+        self.assertEqual(status, 200)
+        self.assertIn(guard.to_log_string(), state['log'])
+        self.assertIn(priest.to_log_string(), state['log'])
+        self.assertEqual(state['on_turn'], 'a')
+        # Whichever pre-move was played, the other is kept.
+        status, state = self.get_json(prefix + '/premoves')
+        self.assertEqual(len(state['premoves']), 1)
+
+
+class MemoryStorageTest(ApiTest):
+    """ The API tests, along with a game played through the pages, with the
+        games held in memory rather than in the database.
+    """
+    def setUp(self):
+        super().setUp()
+        self.sql_storage = application.extensions['storage']
+        application.extensions['storage'] = MemoryStorage()
+
+    def tearDown(self):
+        application.extensions['storage'] = self.sql_storage
+        super().tearDown()
+
+    def test_pages(self):
+        with querylog.capture() as log:
+            game_no, urls = self.start_game(num_players=3)
+            self.assertEqual(self.client.get('/opengames').status_code, 200)
+            for url in urls.values():
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(b'Secret key invalid', response.data)
+            self.play_to_finish(game_no, urls)
+            storage().archive([storage().get_game(game_no)])
+            self.assertIsNone(storage().get_game(game_no))
+            response = self.client.get(urls['a'])
+            self.assertIn(b'This Game is Finished', response.data)
+        self.assertEqual(log.statements, [])
+
+    def test_keyed_game_race(self):
+        """ Of two requests racing to start a game with the same key, both
+            are given the first request's game, and the second's is dropped.
+        """
+        games = [DBGame(num_players=2, state_log='') for _ in range(2)]
+        for db_game in games:
+            self.assertIsNone(storage().keyed_game('key', 60))
+            storage().add_game(db_game)
+        self.assertIs(storage().store_keyed_game('key', games[0]), games[0])
+        self.assertIs(storage().store_keyed_game('key', games[1]), games[0])
+        self.assertIsNone(storage().get_game(games[1].id))
+        self.assertIs(storage().keyed_game('key', 60), games[0])
+        # A key left by a game which has since started is replaced.
+        games[0].game_started = True
+        self.assertIsNone(storage().keyed_game('key', 60))
+        db_game = DBGame(num_players=2, state_log='')
+        storage().add_game(db_game)
+        self.assertIs(storage().store_keyed_game('key', db_game), db_game)
+
+
+class TokenTest(RouteTest):
+    def test_revoke(self):
+        game_no, urls = self.start_game(num_players=2)
+        token = urls['a'].rsplit('/', 1)[-1]
+        db_game = database.session.query(DBGame).get(game_no)
+        new_tokens = db_game.revoke_tokens()
+        database.session.commit()
+
+        response = self.client.get(urls['a'])
+        self.assertIn(b'Secret key invalid', response.data)
+        response = self.client.get('/api/game/{0}/{1}'.format(game_no, token))
+        self.assertEqual(response.status_code, 403)
+        state_log = db_game.state_log
+        game = db_game.load_game()
+        pmoves_one, pmoves_two = game.available_moves()
+        move = (pmoves_one.moves + pmoves_two.moves)[0]
+        old_url = urls[game.on_turn[0]]
+        self.client.get(self.playcard_url(game_no, old_url, move))
+        database.session.expire_all()
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertEqual(db_game.state_log, state_log)
+
+        new_url = '/viewgame/{0}/{1}'.format(
+            game_no, new_tokens[game.on_turn[0]])
+        self.client.get(self.playcard_url(game_no, new_url, move))
+        database.session.expire_all()
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertNotEqual(db_game.state_log, state_log)
+        response = self.client.get('/api/game/{0}/{1}'.format(
+            game_no, new_tokens['a']))
+        self.assertEqual(response.status_code, 200)
+
+    def test_reused_game_id(self):
+        """ Should a game be given the id of an earlier one, the tokens of
+            the earlier game are not accepted for it.
+        """
+        game_no, urls = self.start_game(num_players=2)
+        old_token = urls['a'].rsplit('/', 1)[-1]
+        db_game = database.session.query(DBGame).get(game_no)
+        for profile in db_game.players:
+            database.session.delete(profile)
+        database.session.delete(db_game)
+        database.session.commit()
+        state_log = Game(player_names(2)).serialise_game()
+        db_game = DBGame(id=game_no, num_players=2, state_log=state_log)
+        database.session.add(db_game)
+        profile = db_game.take_player('a')
+        database.session.commit()
+
+        response = self.client.get('/api/game/{0}/{1}'.format(game_no,
+                                                              old_token))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(urls['a'])
+        self.assertIn(b'Secret key invalid', response.data)
+        response = self.client.get('/api/game/{0}/{1}'.format(
+            game_no, db_game.viewer_token(profile)))
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_tokens(self):
+        game_no, urls = self.start_game(num_players=2)
+        other_no, other_urls = self.start_game(num_players=2)
+        token = urls['a'].rsplit('/', 1)[-1]
+        for invalid in [token[:-1], token + 'x', 'abc',
+                        other_urls['a'].rsplit('/', 1)[-1]]:
+            response = self.client.get('/api/game/{0}/{1}'.format(game_no,
+                                                                  invalid))
+            self.assertEqual(response.status_code, 403)
+
+    def test_no_profile_query(self):
+        """ Playing a card is authenticated by the token alone."""
+        game_no, urls = self.start_game()
+        game = database.session.query(DBGame).get(game_no).load_game()
+        pmoves_one, pmoves_two = game.available_moves()
+        url = self.playcard_url(game_no, urls[game.on_turn[0]],
+                                (pmoves_one.moves + pmoves_two.moves)[0])
+        database.session.expire_all()
+        with querylog.capture() as log:
+            self.client.get(url)
+        statements = [s.statement for s in log.statements]
+        self.assertTrue(statements)
+        for statement in statements:
+            self.assertNotIn(DBLightProfile.__tablename__, statement)
+
+
+class MetricsTest(RouteTest):
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+        super().tearDown()
+
+    def test_metrics(self):
+        game_no, urls = self.start_game()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 404)
+        metrics.enable()
+        self.client.get(urls['a'])
+        text = self.client.get('/metrics').data.decode('utf-8')
+        for phase in ['request', 'db_query', 'render']:
+            labels = '{{route="viewgame",phase="{0}"}}'.format(phase)
+            self.assertIn('loveletter_phase_seconds_count' + labels, text)
+        # The game is read from its view, so nothing is replayed.
+        for phase in ['log_parse', 'replay']:
+            labels = '{{route="viewgame",phase="{0}"}}'.format(phase)
+            self.assertNotIn('loveletter_phase_seconds_count' + labels, text)
+
+
+class QueryCountTest(RouteTest):
+    def setUp(self):
+        super().setUp()
+        application.config['CHECKPOINT_INTERVAL'] = 1
+
+    def tearDown(self):
+        application.config['CHECKPOINT_INTERVAL'] = (
+            Configuration.CHECKPOINT_INTERVAL)
+        super().tearDown()
+
+    def play_moves(self, game_no, num_moves):
+        for _ in range(num_moves):
+            game = database.session.query(DBGame).get(game_no).load_game()
+            if game.is_game_finished():
+                return
+            pmoves_one, pmoves_two = game.available_moves()
+            self.client.get(self.playcard_url(
+                game_no, self.urls[game_no][game.on_turn[0]],
+                random.choice(pmoves_one.moves + pmoves_two.moves)))
+            database.session.expire_all()
+
+    def test_viewgame(self):
+        game_no, urls = self.start_game()
+        self.urls = {game_no: urls}
+        self.play_moves(game_no, 3)
+        with self.assertMaxQueries(1):
+            self.client.get(urls['a'])
+        with self.assertMaxQueries(1):
+            self.client.get('/opengames')
+
+    def test_api_batch(self):
+        """ The number of statements to fetch a batch of games through the API
+            should not grow with the number of games.
+        """
+        self.urls = dict()
+        for _ in range(3):
+            game_no, urls = self.start_game()
+            self.urls[game_no] = urls
+            self.play_moves(game_no, 2)
+        requested = [{'game': game_no, 'token': urls['a'].rsplit('/', 1)[-1]}
+                     for game_no, urls in self.urls.items()]
+        database.session.expire_all()
+        with self.assertMaxQueries(2) as log:
+            self.client.post('/api/games', data=json.dumps(
+                {'games': requested}), content_type='application/json')
+        self.assertEqual(log.repeated(), [])
+
+
+class CheckpointTest(RouteTest):
+    def tearDown(self):
+        application.config['CHECKPOINT_INTERVAL'] = (
+            Configuration.CHECKPOINT_INTERVAL)
+        super().tearDown()
+
+    def test_several_moves_saved(self):
+        """ Each multiple of the interval passed is checkpointed, even when a
+            save plays several moves at once.
+        """
+        application.config['CHECKPOINT_INTERVAL'] = 3
+        game_no, _ = self.start_game()
+        db_game = storage().get_game(game_no)
+        game = db_game.load_game()
+        while not game.is_game_finished():
+            for _ in range(2):
+                if not game.is_game_finished():
+                    pmoves_one, pmoves_two = game.available_moves()
+                    game.play_move(random.choice(pmoves_one.moves +
+                                                 pmoves_two.moves))
+            db_game.save_game(game)
+            storage().commit()
+        checkpoints = [c.num_moves for c in db_game.checkpoints.order_by(
+            DBCheckpoint.num_moves)]
+        multiples = range(3, game.num_moves + 1, 3)
+        self.assertEqual(len(checkpoints), len(multiples))
+        for num_moves, multiple in zip(checkpoints, multiples):
+            self.assertIn(num_moves, [multiple, multiple + 1])
+
+
+class GameCacheTest(RouteTest):
+    def check_cache(self, cache):
+        self.assertIsNone(cache.get(1, '1-a'))
+        cache.set(1, '1-a', {'moves': 1})
+        self.assertEqual(cache.get(1, '1-a'), {'moves': 1})
+        self.assertIsNone(cache.get(1, '2-a'))
+        cache.set(1, '2-a', {'moves': 2})
+        self.assertIsNone(cache.get(1, '1-a'))
+        self.assertEqual(cache.get(1, '2-a'), {'moves': 2})
+        cache.delete(1)
+        self.assertIsNone(cache.get(1, '2-a'))
+
+    def test_memory_cache(self):
+        self.check_cache(gamecache.MemoryCache())
+        cache = gamecache.MemoryCache(max_size=1)
+        cache.set(1, '1-a', {})
+        cache.set(2, '1-a', {})
+        self.assertIsNone(cache.get(1, '1-a'))
+
+    def test_directory_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_cache(gamecache.DirectoryCache(directory))
+            # Another process sees the snapshots stored by this one.
+            gamecache.DirectoryCache(directory).set(1, '1-a', {'moves': 1})
+            self.assertEqual(gamecache.DirectoryCache(directory).get(1, '1-a'),
+                             {'moves': 1})
+
+    def test_directory_cache_size(self):
+        """ Once the directory holds too many snapshots the oldest are
+            removed.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = gamecache.DirectoryCache(directory, max_size=3,
+                                             prune_interval=2)
+            for game_id in range(1, 6):
+                cache.set(game_id, '1-a', {'moves': game_id})
+                os.utime(cache.path(game_id), (game_id, game_id))
+            cache.prune()
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['3.json', '4.json', '5.json'])
+            self.assertEqual(cache.get(5, '1-a'), {'moves': 5})
+
+    def test_archived_games_dropped(self):
+        cache = application.extensions['game_cache']
+        game_no, urls = self.start_game(num_players=2)
+        self.play_to_finish(game_no, urls)
+        db_game = database.session.query(DBGame).get(game_no)
+        version = db_game.cache_version()
+        self.assertIsNotNone(cache.get(game_no, version))
+        database.session.remove()
+        archive_finished_games()
+        self.assertIsNone(cache.get(game_no, version))
+
+    def test_cached_game(self):
+        """ A game restored from the cache is the same as one replayed from
+            its log, and the cache is kept up to date as moves are played.
+        """
+        cache = application.extensions['game_cache']
+        game_no, urls = self.start_game()
+        for _ in range(10):
+            db_game = database.session.query(DBGame).get(game_no)
+            cache.delete(game_no)
+            game = db_game.load_game()
+            if game.is_game_finished():
+                break
+            self.assertIsNotNone(cache.get(game_no, db_game.cache_version()))
+            cached_game = db_game.load_game()
+            self.assertEqual(cached_game.checkpoint(), game.checkpoint())
+            self.assertEqual(cached_game.serialise_game(),
+                             game.serialise_game())
+            self.assertEqual(
+                [m.to_log_string() for pmoves in cached_game.available_moves()
+                 for m in pmoves.moves],
+                [m.to_log_string() for pmoves in game.available_moves()
+                 for m in pmoves.moves])
+            pmoves_one, pmoves_two = game.available_moves()
+            self.client.get(self.playcard_url(
+                game_no, urls[game.on_turn[0]],
+                random.choice(pmoves_one.moves + pmoves_two.moves)))
+            database.session.expire_all()
+            db_game = database.session.query(DBGame).get(game_no)
+            self.assertIsNotNone(cache.get(game_no, db_game.cache_version()))
+
+
+class ArchiveTest(RouteTest):
+    def test_archive(self):
+        game_no, urls = self.start_game()
+        open_game_no, _ = self.start_game()
+        self.play_to_finish(game_no, urls)
+        before = self.client.get(urls['a'])
+        database.session.remove()
+
+        self.assertEqual(archive_finished_games(batch_size=1), 1)
+        self.assertIsNone(database.session.query(DBGame).get(game_no))
+        self.assertEqual(database.session.query(DBLightProfile).filter_by(
+            game_id=game_no).count(), 0)
+        self.assertIsNotNone(database.session.query(DBGame).get(open_game_no))
+
+        after = self.client.get(urls['a'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.get_etag(), before.get_etag())
+        self.assertEqual(after.data, before.data)
+        response = self.client.get('/viewgame/{0}/at/1'.format(game_no))
+        self.assertEqual(response.status_code, 200)
+
+        # The API finds the archived game, alone or in a batch.
+        token = urls['a'].rsplit('/', 1)[-1]
+        response = self.client.get('/api/game/{0}/{1}'.format(game_no, token))
+        single = json.loads(response.data.decode('utf-8'))
+        response = self.client.post('/api/games', data=json.dumps(
+            {'games': [{'game': game_no, 'token': token},
+                       {'game': open_game_no}]}),
+            content_type='application/json')
+        batch = json.loads(response.data.decode('utf-8'))['games']
+        self.assertEqual(batch[0], single)
+        self.assertTrue(batch[0]['finished'])
+        self.assertNotIn('error', batch[1])
+
+    def test_ids_not_reused(self):
+        """ Archiving the newest game does not free its id, or those of its
+            players, for the next game.
+        """
+        game_no, urls = self.start_game(num_players=2)
+        self.play_to_finish(game_no, urls)
+        profile_ids = {p.id for p in database.session.query(DBGame).get(
+            game_no).players}
+        database.session.remove()
+        self.assertEqual(archive_finished_games(), 1)
+
+        new_game_no, new_urls = self.start_game(num_players=2)
+        self.assertGreater(new_game_no, game_no)
+        new_profile_ids = {p.id for p in database.session.query(DBGame).get(
+            new_game_no).players}
+        self.assertGreater(min(new_profile_ids), max(profile_ids))
+        self.play_to_finish(new_game_no, new_urls)
+        database.session.remove()
+        self.assertEqual(archive_finished_games(), 1)
+        self.assertEqual(database.session.query(ArchivedGame).count(), 2)
+
+    def test_premoves_archived(self):
+        """ The pre-moves of an archived game are not found. """
+        game_no, urls = self.start_game(num_players=2)
+        self.play_to_finish(game_no, urls)
+        database.session.remove()
+        self.assertEqual(archive_finished_games(), 1)
+        url = '/api/game/{0}/{1}/premoves'.format(
+            game_no, urls['a'].rsplit('/', 1)[-1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.post(url, data=json.dumps({'premoves': []}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class VerifyTest(RouteTest):
+    def test_verify(self):
+        archived_no, urls = self.start_game(num_players=2)
+        self.play_to_finish(archived_no, urls)
+        database.session.remove()
+        archive_finished_games()
+        game_nos = [self.start_game(num_players=3)[0] for _ in range(4)]
+        broken = database.session.query(DBGame).get(game_nos[1])
+        broken.state_log += "\nc,9,,"
+        unmarked = database.session.query(DBGame).get(game_nos[2])
+        unmarked.game_finished = True
+        database.session.commit()
+
+        problems = []
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'verify.json')
+            progress = verify.verify(
+                iter_stored_games(chunk_size=2), workers=2,
+                checkpoint=checkpoint, on_problem=problems.append)
+            self.assertEqual(progress.checked, 5)
+            self.assertEqual(len(problems), 2)
+
+            # A finished scan leaves no checkpoint, so the next checks every
+            # game again.
+            self.assertIsNone(verify.read_checkpoint(checkpoint))
+            progress = verify.verify(
+                iter_stored_games(chunk_size=2), workers=2,
+                checkpoint=checkpoint,
+                progress=verify.read_checkpoint(checkpoint),
+                on_problem=problems.append)
+            self.assertEqual(progress.checked, 5)
+            self.assertIsNone(verify.read_checkpoint(checkpoint))
+        self.assertEqual([(p.source, p.game_id) for p in problems],
+                         [('game', game_nos[1]), ('game', game_nos[2])] * 2)
+        self.assertIn('Replay failed', problems[0].message)
+        self.assertIn('Recorded as finished', problems[1].message)
+
+        # A scan resumed after the first chunk reads only the rest.
+        first_position = next(iter_stored_games(chunk_size=2))[0]
+        resumed = [stored.game_id for _, chunk in iter_stored_games(
+            after=first_position, chunk_size=2) for stored in chunk]
+        self.assertEqual(resumed, game_nos[2:] + [archived_no])
+
+
+class ExportTest(RouteTest):
+    def test_export_import(self):
+        game_no, urls = self.start_game()
+        self.play_to_finish(game_no, urls)
+        self.start_game(num_players=3)
+        archive_finished_games()
+        logs = [log for _, log in iter_game_logs(chunk_size=1)]
+        self.assertEqual(len(logs), 2)
+
+        records = list(iter_game_records(chunk_size=1))
+        self.assertEqual(len(records), sum(len(log.split("\n"))
+                                           for log in logs))
+        for record in records:
+            self.assertEqual(sorted(record), sorted(RECORD_FIELDS))
+        records = [json.loads(json.dumps(record)) for record in records]
+        self.assertEqual(import_game_records(records, batch_size=1), 2)
+
+        imported = database.session.query(DBGame).filter(
+            DBGame.id > max(r['game_id'] for r in records)).order_by(DBGame.id)
+        self.assertEqual([db_game.state_log for db_game in imported], logs)
+        self.assertEqual([db_game.game_finished for db_game in imported],
+                         [False, True])
+        self.assertEqual([db_game.num_players for db_game in imported],
+                         [3, 4])
+
+
+class StartGameTest(RouteTest):
+    def tearDown(self):
+        application.config['STARTGAME_WINDOW'] = 60
+        super().tearDown()
+
+    def start(self, num_players=4, client=None, **kwargs):
+        client = self.client if client is None else client
+        response = client.get('/startgame?players={0}'.format(num_players),
+                              **kwargs)
+        return int(response.headers['Location'].rsplit('/', 1)[-1])
+
+    def test_repeated_start(self):
+        game_no = self.start()
+        with self.assertMaxQueries(2):
+            self.assertEqual(self.start(), game_no)
+        self.assertNotEqual(self.start(num_players=3), game_no)
+        self.assertNotEqual(self.start(client=application.test_client()),
+                            game_no)
+        self.assertEqual(database.session.query(DBGame).count(), 3)
+
+        headers = {'Idempotency-Key': 'retry'}
+        other_game_no = self.start(headers=headers)
+        self.assertNotEqual(other_game_no, game_no)
+        self.assertEqual(self.start(headers=headers), other_game_no)
+
+    def test_started_or_expired(self):
+        game_no = self.start()
+        for player in player_names(4):
+            self.client.get('/joingame/{0}/{1}'.format(game_no, player))
+        next_game_no = self.start()
+        self.assertNotEqual(next_game_no, game_no)
+        application.config['STARTGAME_WINDOW'] = 0
+        self.assertNotEqual(self.start(), next_game_no)
+
+
+class RateLimitTest(RouteTest):
+    def tearDown(self):
+        viewgame_limiter.burst = application.config['VIEWGAME_BURST']
+        viewgame_limiter.buckets.clear()
+        super().tearDown()
+
+    def test_token_bucket(self):
+        limiter = ratelimit.RateLimiter(rate=1000, burst=2)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertGreater(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('b'), 0)
+        time.sleep(0.01)
+        self.assertEqual(limiter.acquire('a'), 0)
+        limiter.sweep(time.monotonic() + 1)
+        self.assertEqual(limiter.buckets, dict())
+
+    def test_viewgame_limit(self):
+        game_no, urls = self.start_game()
+        viewgame_limiter.burst = 2
+        viewgame_limiter.buckets.clear()
+        for _ in range(2):
+            self.assertEqual(self.client.get(urls['a']).status_code, 200)
+        response = self.client.get(urls['a'])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.client.get(urls['b']).status_code, 200)
+
+    def test_poll_interval(self):
+        game_no, urls = self.start_game()
+        for _ in range(5):
+            db_game = database.session.query(DBGame).get(game_no)
+            game = db_game.load_game()
+            if game.is_game_finished():
+                self.assertIsNone(db_game.player_on_turn)
+                break
+            on_turn = game.on_turn[0]
+            self.assertEqual(db_game.player_on_turn, on_turn)
+            for player, url in urls.items():
+                response = self.client.get(url)
+                interval = ('POLL_INTERVAL_ON_TURN' if player == on_turn
+                            else 'POLL_INTERVAL_WAITING')
+                expected = str(application.config[interval])
+                self.assertEqual(response.headers['X-Poll-Interval'],
+                                 expected)
+                etag, _ = response.get_etag()
+                response = self.client.get(
+                    url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.headers['X-Poll-Interval'],
+                                 expected)
+            pmoves_one, pmoves_two = game.available_moves()
+            self.client.get(self.playcard_url(
+                game_no, urls[on_turn],
+                random.choice(pmoves_one.moves + pmoves_two.moves)))
+            database.session.expire_all()
+            viewgame_limiter.buckets.clear()
+
+
+class MatchmakingTest(RouteTest):
+    def setUp(self):
+        super().setUp()
+        matchmaker.waiting.clear()
+        matchmaker.tickets.clear()
+
+    def enqueue(self, num_players):
+        response = self.client.get('/matchmaking?players={0}'.format(
+            num_players))
+        self.assertEqual(response.status_code, 302)
+        return response.headers['Location']
+
+    def test_matchmaking(self):
+        waiting = [self.enqueue(3) for _ in range(2)]
+        other = self.enqueue(2)
+        for url in waiting + [other]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(database.session.query(DBGame).count(), 0)
+
+        waiting.append(self.enqueue(3))
+        game_urls = [self.client.get(url).headers['Location']
+                     for url in waiting]
+        db_game = database.session.query(DBGame).one()
+        self.assertTrue(db_game.game_started)
+        self.assertEqual(sorted(p.gamename for p in db_game.players),
+                         db_game.gamenames)
+        secret_key = application.config['SECRET_KEY']
+        seated = {tokens.loads(secret_key, url.rsplit('/', 1)[-1]).profile_id
+                  for url in game_urls}
+        self.assertEqual(seated, {p.id for p in db_game.players})
+        for url in game_urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # A seat is only handed out once.
+        self.assertEqual(self.client.get(waiting[0]).status_code, 302)
+        self.assertEqual(self.client.get(other).status_code, 200)
+
+    def test_timeout(self):
+        abandoned = self.enqueue(2)
+        for ticket in matchmaker.tickets.values():
+            ticket.last_seen -= application.config['MATCHMAKING_TIMEOUT'] + 1
+        for _ in range(2):
+            self.enqueue(2)
+        self.assertEqual(database.session.query(DBGame).count(), 1)
+        self.assertEqual(len(matchmaker.tickets), 2)
+        response = self.client.get(abandoned)
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('viewgame', response.headers['Location'])
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class RoutingTest(unittest.TestCase):
+    def test_hash_ring(self):
+        ring = routing.HashRing(['one', 'two', 'three'])
+        owners = {game_no: ring.node_for(game_no) for game_no in range(1000)}
+        for node in ring.nodes:
+            self.assertGreater(list(owners.values()).count(node), 200)
+
+        # A new node only takes games from the others, about a quarter.
+        ring.add('four')
+        moved = [g for g in owners if ring.node_for(g) != owners[g]]
+        self.assertTrue(all(ring.node_for(g) == 'four' for g in moved))
+        self.assertTrue(150 < len(moved) < 350)
+
+        # When a node leaves only its own games move.
+        ring.remove('four')
+        ring.remove('two')
+        self.assertEqual(ring.nodes, ['one', 'three'])
+        for game_no, owner in owners.items():
+            if owner != 'two':
+                self.assertEqual(ring.node_for(game_no), owner)
+
+    def start_worker(self, name, port=0, delay=0):
+        """ Serve a stand-in for a worker, answering with its own name after
+            the given delay, and return its url.
+        """
+        def worker(environ, start_response):
+            self.requests.append((name, environ['REQUEST_METHOD']))
+            time.sleep(delay)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [name.encode('utf-8')]
+        server = make_server('127.0.0.1', port, worker,
+                             handler_class=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers[name] = server
+        self.addCleanup(server.server_close)
+        return 'http://127.0.0.1:{0}'.format(server.server_port)
+
+    def test_router(self):
+        self.servers = dict()
+        self.requests = []
+        urls = {name: self.start_worker(name) for name in ['a', 'b', 'c']}
+        router = routing.Router(sorted(urls.values()), retry_interval=0)
+        client = Client(router, BaseResponse)
+
+        def owner(game_no):
+            response = client.get('/viewgame/{0}/123'.format(game_no))
+            self.assertEqual(response.status_code, 200)
+            return response.data.decode('utf-8')
+
+        owners = {game_no: owner(game_no) for game_no in range(30)}
+        self.assertEqual(set(owners.values()), {'a', 'b', 'c'})
+        for game_no in owners:
+            self.assertEqual(owner(game_no), owners[game_no])
+            response = client.get('/playcard/{0}/123/1'.format(game_no))
+            self.assertEqual(response.data.decode('utf-8'), owners[game_no])
+
+        # The matchmaking tickets are all kept by one worker.
+        paths = ['/matchmaking', '/matchmaking/1', '/matchmaking/2'] * 5
+        matchmakers = {client.get(path).data for path in paths}
+        self.assertEqual(len(matchmakers), 1)
+
+        # A worker which goes away is taken off the ring, and only its games
+        # move to the others.
+        self.servers['b'].shutdown()
+        self.servers['b'].server_close()
+        with self.assertLogs('app.routing', level='WARNING'):
+            for game_no in owners:
+                if owners[game_no] == 'b':
+                    self.assertIn(owner(game_no), {'a', 'c'})
+                else:
+                    self.assertEqual(owner(game_no), owners[game_no])
+        self.assertEqual(len(router.ring.nodes), 2)
+
+        # Once it is back it takes its games back.
+        stopped = self.servers['b']
+        port = int(urls['b'].rsplit(':', 1)[1])
+        self.start_worker('b', port=port)
+        for game_no in owners:
+            self.assertEqual(owner(game_no), owners[game_no])
+        self.assertEqual(len(router.ring.nodes), 3)
+
+        for server in self.servers.values():
+            if server is not stopped:
+                server.shutdown()
+
+    def test_router_timeout(self):
+        """ A request which a worker does not answer in time is not sent to
+            another, as the worker may have acted on it, and the worker keeps
+            its games.
+        """
+        self.servers = dict()
+        self.requests = []
+        slow = self.start_worker('slow', delay=1)
+        router = routing.Router([slow, self.start_worker('fast')],
+                                timeout=0.2)
+        client = Client(router, BaseResponse)
+        game_no = next(game_no for game_no in range(100)
+                       if router.ring.node_for(game_no) == slow)
+        with self.assertLogs('app.routing', level='WARNING'):
+            for method in ['GET', 'POST']:
+                response = client.open(
+                    '/playcard/{0}/123/1'.format(game_no), method=method)
+                self.assertEqual(response.status_code, 504)
+        self.assertEqual(len(router.ring.nodes), 2)
+        self.assertEqual([request for request in self.requests
+                          if request[0] == 'fast'], [])
+        for server in self.servers.values():
+            server.shutdown()
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_retries(self):
+        job_queue = jobs.JobQueue(workers=2, retry_delay=0.01)
+        attempts = []
+
+        def flaky(name):
+            attempts.append(name)
+            if len(attempts) < 3:
+                raise RuntimeError(name)
+        with self.assertLogs('app.jobs', level='WARNING'):
+            job_queue.enqueue(flaky, 'flaky')
+            self.assertTrue(job_queue.join(timeout=5))
+        self.assertEqual(attempts, ['flaky'] * 3)
+        self.assertEqual(job_queue.failed, [])
+
+        def broken():
+            raise RuntimeError()
+        with self.assertLogs('app.jobs', level='ERROR'):
+            job_queue.enqueue(broken)
+            self.assertTrue(job_queue.join(timeout=5))
+        self.assertEqual(len(job_queue.failed), 1)
+        job_queue.stop()
+
+    def test_concurrency_limit(self):
+        job_queue = jobs.JobQueue(workers=2)
+        lock = threading.Lock()
+        running = []
+        most_running = []
+
+        def job():
+            with lock:
+                running.append(None)
+                most_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+        for _ in range(10):
+            job_queue.enqueue(job)
+        self.assertTrue(job_queue.join(timeout=5))
+        self.assertEqual(len(most_running), 10)
+        self.assertLessEqual(max(most_running), 2)
+        job_queue.stop()
+
+
+class ArchiveJobTest(RouteTest):
+    def setUp(self):
+        super().setUp()
+        self.job_workers = job_queue.workers
+        job_queue.workers = 0
+        application.config['ARCHIVE_FINISHED_GAMES'] = True
+
+    def tearDown(self):
+        application.config['ARCHIVE_FINISHED_GAMES'] = False
+        job_queue.workers = self.job_workers
+        super().tearDown()
+
+    def test_archive_when_finished(self):
+        game_no, urls = self.start_game()
+        self.play_to_finish(game_no, urls)
+        self.assertIsNotNone(database.session.query(DBGame).get(game_no))
+        job_queue.join()
+        self.assertIsNone(database.session.query(DBGame).get(game_no))
+        self.assertIsNotNone(database.session.query(ArchivedGame).get(game_no))
+        self.assertEqual(self.client.get(urls['a']).status_code, 200)
+
+
+class DeadlineHeapTest(unittest.TestCase):
+    def test_deadlines(self):
+        heap = timers.DeadlineHeap()
+        self.assertIsNone(heap.next_deadline())
+        for key in range(10):
+            heap.schedule(key, 100 + key)
+        heap.schedule(3, 50)
+        heap.schedule(5, 200)
+        heap.cancel(7)
+        self.assertEqual(len(heap), 9)
+        self.assertEqual(heap.next_deadline(), 50)
+        self.assertEqual(heap.pop_due(102),
+                         [(3, 50), (0, 100), (1, 101), (2, 102)])
+        self.assertEqual(heap.pop_due(102), [])
+        self.assertEqual([key for key, _ in heap.pop_due(1000)],
+                         [4, 6, 8, 9, 5])
+        self.assertEqual(len(heap), 0)
+
+    def test_stale_entries_removed(self):
+        heap = timers.DeadlineHeap()
+        for deadline in range(1000):
+            heap.schedule('game', deadline)
+        self.assertLess(len(heap.heap), 100)
+        self.assertEqual(heap.pop_due(2000), [('game', 999)])
+
+
+class TurnTimeoutTest(RouteTest):
+    def setUp(self):
+        super().setUp()
+        self.job_workers = job_queue.workers
+        job_queue.workers = 0
+        application.config['TURN_TIMEOUT'] = 60
+
+    def tearDown(self):
+        application.config['TURN_TIMEOUT'] = Configuration.TURN_TIMEOUT
+        job_queue.workers = self.job_workers
+        turn_timer.stop()
+        turn_timer.deadlines = timers.DeadlineHeap()
+        super().tearDown()
+
+    def expire_turn(self, game_no):
+        """ Move the deadline of the game's turn into the past."""
+        db_game = database.session.query(DBGame).get(game_no)
+        db_game.turn_deadline = time.time() - 1
+        database.session.commit()
+        turn_timer.schedule(game_no, db_game.turn_deadline)
+        return db_game.state_log
+
+    def test_timed_out_turn_played(self):
+        game_no, urls = self.start_game(num_players=2)
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertGreater(db_game.turn_deadline, time.time())
+        self.assertEqual(turn_timer.deadlines.deadlines,
+                         {game_no: db_game.turn_deadline})
+
+        state_log = self.expire_turn(game_no)
+        self.assertEqual(turn_timer.fire_due(), 1)
+        job_queue.join()
+        database.session.expire_all()
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertEqual(count_moves(db_game.state_log),
+                         count_moves(state_log) + 1)
+        if db_game.game_finished:
+            self.assertIsNone(db_game.turn_deadline)
+        else:
+            self.assertGreater(db_game.turn_deadline, time.time())
+        view = database.session.query(DBGameView).get((game_no, ''))
+        self.assertEqual(view.version, db_game.version)
+
+    def test_stale_deadline_ignored(self):
+        """ A deadline which fires after the player has moved does nothing.
+        """
+        game_no, urls = self.start_game(num_players=2)
+        self.expire_turn(game_no)
+        turn_timer.fire_due()
+        db_game = database.session.query(DBGame).get(game_no)
+        game = db_game.load_game()
+        pmoves_one, pmoves_two = game.available_moves()
+        self.client.get(self.playcard_url(
+            game_no, urls[game.on_turn[0]],
+            (pmoves_one.moves + pmoves_two.moves)[0]))
+        database.session.expire_all()
+        state_log = database.session.query(DBGame).get(game_no).state_log
+        job_queue.join()
+        database.session.expire_all()
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertEqual(db_game.state_log, state_log)
+
+    def test_racing_processes(self):
+        """ Of two processes playing the same timed out turn, only the first
+            plays a move, even if the second loaded the game beforehand.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database.session.remove()
+        database.drop_all()
+        application.config['SQLALCHEMY_DATABASE_URI'] = (
+            'sqlite:///' + os.path.join(directory.name, 'db.sqlite'))
+        database.create_all()
+        game_no, _ = self.start_game(num_players=2)
+        state_log = self.expire_turn(game_no)
+        deadline = database.session.query(DBGame).get(game_no).turn_deadline
+        loaded = threading.Event()
+        played = threading.Event()
+        stale_games = []
+
+        def other_process():
+            with application.app_context():
+                try:
+                    # Held, so that the session keeps it as loaded.
+                    stale_games.append(storage().get_game(game_no))
+                    loaded.set()
+                    played.wait()
+                    play_timed_out_turn(game_no, deadline)
+                finally:
+                    database.session.remove()
+        thread = threading.Thread(target=other_process)
+        thread.start()
+        loaded.wait()
+        play_timed_out_turn(game_no, deadline)
+        played_log = database.session.query(DBGame).get(game_no).state_log
+        played.set()
+        thread.join()
+        database.session.expire_all()
+        db_game = database.session.query(DBGame).get(game_no)
+        self.assertEqual(count_moves(played_log), count_moves(state_log) + 1)
+        self.assertEqual(db_game.state_log, played_log)
+
+    def test_deadlines_loaded(self):
+        game_no, _ = self.start_game(num_players=2)
+        open_game_no = int(self.client.get('/startgame?players=3').headers[
+            'Location'].rsplit('/', 1)[-1])
+        turn_timer.deadlines = timers.DeadlineHeap()
+        load_turn_deadlines()
+        self.assertEqual(set(turn_timer.deadlines.deadlines), {game_no})
+        self.assertNotIn(open_game_no, turn_timer.deadlines.deadlines)
+
+
+class ReaderSessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.config = dict(application.config)
+        self.app_context = application.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        application.config.update(self.config)
+
+    def test_reader_uri(self):
+        readers = ReaderSessions()
+        application.config['SQLALCHEMY_READER_URI'] = None
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.assertIsNone(readers.reader_uri())
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/db'
+        self.assertEqual(readers.reader_uri(),
+                         'sqlite:///file:/tmp/db?mode=ro&uri=true')
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://h/db'
+        self.assertIsNone(readers.reader_uri())
+        application.config['SQLALCHEMY_READER_URI'] = 'postgresql://r/db'
+        self.assertEqual(readers.reader_uri(), 'postgresql://r/db')
+
+    def test_sqlite_settings(self):
+        """ Both the writers' and the readers' connections to a database file
+            are given our settings, and the readers cannot write.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'db.sqlite')
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        application.config['SQLALCHEMY_READER_URI'] = None
+        database.create_all()
+        self.addCleanup(database.session.remove)
+
+        def pragma(session, name):
+            return session.execute('PRAGMA ' + name).scalar()
+        readers = ReaderSessions()
+        self.addCleanup(readers.remove)
+        for session in [database.session(), readers()]:
+            self.assertEqual(pragma(session, 'journal_mode'), 'wal')
+            self.assertEqual(pragma(session, 'busy_timeout'), 5000)
+            # NORMAL
+            self.assertEqual(pragma(session, 'synchronous'), 1)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            readers().execute('DELETE FROM game')
+
+        # The readers' pool for a database no longer read is closed.
+        engine = readers.engine
+        closed = []
+        sqlalchemy.event.listen(engine, 'close',
+                                lambda *args: closed.append(1))
+        readers.remove()
+        application.config['SQLALCHEMY_READER_URI'] = 'sqlite://'
+        readers()
+        self.assertIsNot(readers.engine, engine)
+        self.assertEqual(closed, [1])
+
+    def test_threads(self):
+        """ A pooled reader connection may be used by a thread other than
+            the one which opened it.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'db.sqlite')
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        application.config['SQLALCHEMY_READER_URI'] = None
+        application.config['READER_POOL_SIZE'] = 1
+        database.create_all()
+        self.addCleanup(database.session.remove)
+        readers = ReaderSessions()
+        self.addCleanup(readers.remove)
+        counts = []
+
+        def read():
+            with application.app_context():
+                try:
+                    counts.append(readers().query(DBGame).count())
+                finally:
+                    readers.remove()
+        # One after the other, so that both use the single connection.
+        for _ in range(2):
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+        self.assertEqual(counts, [0, 0])
@@ -0,0 +1,134 @@
+"""Deadlines, such as for each game's current turn, kept in a heap.
+
+A deadline is set, moved or cancelled whenever a game changes, and fires when
+it passes. `DeadlineHeap` keeps the deadlines in a binary heap so that each of
+these costs O(log n) in the number of deadlines, and finding the next one to
+fire is O(1). Rather than searching the heap for the entry to move or cancel,
+the current deadline of each key is kept in a dict and entries which no
+longer match it are discarded when they reach the top. The heap is rebuilt
+once such stale entries outnumber the live ones, so it does not grow without
+bound.
+
+`TurnTimer` runs a thread which sleeps until the next deadline and passes
+each key that has passed its deadline to a callback. The deadlines are held
+in memory, so whoever sets them must also store them and schedule them again
+when the process starts.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineHeap(object):
+    def __init__(self):
+        self.heap = []
+        self.deadlines = dict()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, key, deadline):
+        """ Set the deadline for the key, replacing any it already has."""
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+        if len(self.heap) > 2 * len(self.deadlines) + 16:
+            self.heap = [(d, k) for k, d in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def _discard_stale(self):
+        while self.heap:
+            deadline, key = self.heap[0]
+            if self.deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        """ The earliest deadline, or None if there are none."""
+        self._discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """ Remove and return the keys, with their deadlines, whose deadlines
+            are no later than `now`, earliest first.
+        """
+        due = []
+        while True:
+            self._discard_stale()
+            if not self.heap or self.heap[0][0] > now:
+                return due
+            deadline, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            due.append((key, deadline))
+
+
+class TurnTimer(object):
+    """ Calls `callback(key, deadline)` for each deadline once it has passed,
+    from a thread started when the first deadline is scheduled. Deadlines are
+    given as times since the epoch, see `time.time`, so that they may be
+    stored and scheduled again by another process.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.deadlines = DeadlineHeap()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, key, deadline):
+        with self._condition:
+            self.deadlines.schedule(key, deadline)
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='turn-timer')
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, key):
+        with self._condition:
+            self.deadlines.cancel(key)
+
+    def fire_due(self, now=None):
+        """ Call back for every deadline which has passed, returning how many
+            there were.
+        """
+        with self._condition:
+            due = self.deadlines.pop_due(time.time() if now is None else now)
+        for key, deadline in due:
+            try:
+                self.callback(key, deadline)
+            except Exception:
+                logger.exception("Deadline callback failed for %r", key)
+        return len(due)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                next_deadline = self.deadlines.next_deadline()
+                if next_deadline is None:
+                    self._condition.wait()
+                else:
+                    wait = next_deadline - time.time()
+                    if wait > 0:
+                        self._condition.wait(wait)
+                if self._stopped:
+                    return
+            self.fire_due()
+
+    def stop(self):
+        """ Stop the thread, keeping the deadlines."""
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,46 @@
+"""Signed tokens identifying a player of a game.
+
+A player is given a token when they join a game, which is part of the
+address of their view of the game. The token holds the id of the game, the
+id and name of the player's profile and the game's key version, signed with
+the application's secret key, so a request can be authenticated from the
+token alone rather than by looking up the players of the game.
+
+Since nothing is stored for a token, one cannot be revoked on its own.
+Instead each game has a key version, and only tokens carrying the game's
+current version are accepted, so incrementing it revokes every token issued
+for the game. The key version of a new game is chosen at random, so it also
+serves to tell apart games which were given the same id.
+"""
+
+from collections import namedtuple
+
+from itsdangerous import BadData, URLSafeSerializer
+
+# Keeps these signatures distinct from any others made with the same key.
+SALT = 'viewer-token'
+
+ViewerToken = namedtuple('ViewerToken', ['game_id', 'profile_id', 'gamename',
+                                         'key_version'])
+
+
+def dumps(secret_key, token):
+    """ The signed form of the given `ViewerToken`, safe for use in URLs."""
+    return URLSafeSerializer(secret_key, salt=SALT).dumps(list(token))
+
+
+def loads(secret_key, signed):
+    """ The `ViewerToken` signed, or None if it is not a valid token. The key
+        version is not checked, since that needs the game.
+    """
+    try:
+        fields = URLSafeSerializer(secret_key, salt=SALT).loads(signed)
+        token = ViewerToken(*fields)
+    except (BadData, TypeError):
+        return None
+    if not (isinstance(token.game_id, int) and
+            isinstance(token.profile_id, int) and
+            isinstance(token.gamename, str) and
+            isinstance(token.key_version, int)):
+        return None
+    return token
@@ -0,0 +1,141 @@
+"""Verification that every stored game still replays under the engine.
+
+A change to the rules or to the log format may leave stored logs which no
+longer replay, or replay to a different end. `verify` replays every game
+given to it, in chunks spread over a pool of processes, and reports each
+log which fails to replay, whose replay disagrees with what is stored about
+the game, or which ends with winners other than the players holding the
+best cards.
+
+A scan of every game may take hours, so the position reached is written to
+a checkpoint file after each chunk. An interrupted scan picks up from there,
+rechecking at most the chunks which were in progress. The checkpoint is
+removed once the scan is finished, so the next scan starts from the first
+game again.
+"""
+
+import concurrent.futures
+import json
+import os
+import tempfile
+from collections import deque, namedtuple
+
+from app.engine import Game, player_names
+
+# A stored game, as read for checking. `finished` is whether the game is
+# recorded as finished and `winners` the JSON list of winners recorded for
+# it, either may be None if nothing is recorded.
+StoredGame = namedtuple('StoredGame', ['source', 'game_id', 'num_players',
+                                       'state_log', 'finished', 'winners'])
+
+Problem = namedtuple('Problem', ['source', 'game_id', 'message'])
+
+
+def check_game(stored):
+    """ The problems found with a stored game, as a list of messages."""
+    try:
+        game = Game(player_names(stored.num_players), log=stored.state_log)
+    except Exception as exception:
+        return ["Replay failed: {0!r}".format(exception)]
+    problems = []
+    finished = game.is_game_finished()
+    if stored.finished is not None and bool(stored.finished) != finished:
+        problems.append("Recorded as {0}finished but the replay is {1}"
+                        .format('' if stored.finished else 'not ',
+                                'finished' if finished else 'in play'))
+    winners = sorted(game.winners or [])
+    if finished:
+        live_players = game.live_players()
+        best = max(game.hands[p] for p in live_players)
+        expected = sorted(p for p in live_players if game.hands[p] == best)
+        if winners != expected:
+            problems.append("Replay has winners {0} but the best hands are "
+                            "held by {1}".format(winners, expected))
+    elif winners:
+        problems.append("Replay has winners {0} before it is finished"
+                        .format(winners))
+    if stored.winners is not None:
+        recorded = sorted(json.loads(stored.winners) or [])
+        if recorded != winners:
+            problems.append("Recorded winners {0} but the replay has {1}"
+                            .format(recorded, winners))
+    return problems
+
+
+def check_chunk(games):
+    """ The problems found with each of the given stored games."""
+    return [Problem(stored.source, stored.game_id, message)
+            for stored in games for message in check_game(stored)]
+
+
+Progress = namedtuple('Progress', ['position', 'checked', 'problems'])
+
+
+def read_checkpoint(path):
+    """ The progress recorded in the checkpoint file, or None if there is
+        none. The position is that after the last game checked.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+    return Progress(tuple(data['position']), data['checked'],
+                    data['problems'])
+
+
+def write_checkpoint(path, progress):
+    """ Replace the checkpoint file, such that an interrupted write leaves
+        the previous checkpoint in place.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory,
+                                     delete=False) as output:
+        json.dump(progress._asdict(), output)
+    os.replace(output.name, path)
+
+
+def verify(chunks, workers=None, checkpoint=None, progress=None,
+           on_problem=None):
+    """ Check the games of the given chunks, each a position and a list of
+    `StoredGame`, with a pool of `workers` processes, one per CPU by default.
+    Calls `on_problem` with each `Problem` found and, after each chunk, writes
+    the progress to the `checkpoint` file if given, which is removed once
+    every chunk is checked. Counting continues from the given `Progress`, if
+    any. Returns the final progress.
+    """
+    if progress is None:
+        progress = Progress(None, 0, 0)
+    workers = workers or os.cpu_count() or 1
+    pending = deque()
+
+    def finish_oldest():
+        nonlocal progress
+        position, num_games, future = pending.popleft()
+        problems = future.result()
+        for problem in problems:
+            if on_problem is not None:
+                on_problem(problem)
+        # Chunks are finished in order, so every game up to this position
+        # has been checked.
+        progress = Progress(position, progress.checked + num_games,
+                            progress.problems + len(problems))
+        if checkpoint is not None:
+            write_checkpoint(checkpoint, progress)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for position, games in chunks:
+            pending.append((position, len(games),
+                            executor.submit(check_chunk, games)))
+            # Read ahead only as far as keeps the workers busy.
+            if len(pending) > 2 * workers:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    if checkpoint is not None:
+        try:
+            os.remove(checkpoint)
+        except FileNotFoundError:
+            # There were no chunks to check.
+            pass
+    return progress
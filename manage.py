@@ -1,10 +1,20 @@
+import cProfile
+import gzip
+import json
 import os
+import pstats
+import random
+import time
 
-from flask.ext.script import Manager
+import flask
+from flask.ext.script import Command, Manager
 from flask.ext.migrate import Migrate, MigrateCommand
 
 from app import main
-from app.main import application, database
+from app.engine import player_names
+from app.main import database
+
+application = main.create_app()
 
 migrate = Migrate(application, database)
 manager = Manager(application)
@@ -49,8 +59,8 @@ def test_casper(name=None):
 
 @manager.command
 def test_main():
-    """Run the python only tests defined within app/main.py"""
-    return run_command("python -m unittest app.main")
+    """Run the python only tests of the engine and the application"""
+    return run_command("python -m unittest app.test_engine app.test_main")
 
 
 @manager.command
@@ -89,6 +99,220 @@ def coverage(quick=False, browser=False, phantom=False):
     os.system("coverage html")
 
 
+def play_scripted_session(client, num_games, num_players):
+    """ Start, join and play through the given number of games using the
+        test client, viewing the game as each player between the moves.
+    """
+    for _ in range(num_games):
+        response = client.get('/startgame?players={0}'.format(num_players))
+        game_no = int(response.headers['Location'].rsplit('/', 1)[-1])
+        client.get('/opengames')
+        view_urls = []
+        for player in player_names(num_players):
+            response = client.get('/joingame/{0}/{1}'.format(game_no, player))
+            view_urls.append(response.headers['Location'])
+        api_urls = ['/api/game/{0}/{1}'.format(game_no, url.rsplit('/', 1)[-1])
+                    for url in view_urls]
+        finished = False
+        while not finished:
+            for view_url, api_url in zip(view_urls, api_urls):
+                client.get(view_url)
+                response = client.get(api_url + '/moves')
+                moves = json.loads(response.data.decode('utf-8'))['moves']
+                if moves:
+                    response = client.post(
+                        api_url + '/move',
+                        data=json.dumps({'move': random.choice(moves)}),
+                        content_type='application/json')
+                    state = json.loads(response.data.decode('utf-8'))
+                    finished = state['finished']
+                    if finished:
+                        break
+
+
+@manager.command
+def profile(games=20, players=4, output=None):
+    """Profile a scripted session of games against an in-memory database"""
+    application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    application.config['WTF_CSRF_ENABLED'] = False
+    with application.app_context():
+        database.create_all()
+        client = application.test_client()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        play_scripted_session(client, int(games), int(players))
+        profiler.disable()
+    if output is not None:
+        profiler.dump_stats(output)
+    stats = pstats.Stats(profiler)
+    stats.sort_stats('cumulative').print_stats(30)
+    return 0
+
+
+@manager.command
+def fuzz(cases=1000, seed=None):
+    """Compare the ways of restoring a game on random and illegal moves"""
+    from app.fuzz import describe, fuzz as fuzz_engines
+    if seed is None:
+        seed = random.randrange(1 << 32)
+    print("Fuzzing {0} cases with seed {1}".format(cases, seed))
+    failures = 0
+    for case, mismatch in fuzz_engines(int(cases), seed=int(seed)):
+        failures += 1
+        print("Mismatch in {0.engine} after step {0.step} in {0.field}:"
+              .format(mismatch))
+        print("  expected: {0!r}".format(mismatch.expected))
+        print("  actual:   {0!r}".format(mismatch.actual))
+        print("Case: {0}".format(case.to_json()))
+        print(describe(case))
+    print("{0} failing cases".format(failures))
+    return 1 if failures else 0
+
+
+@manager.option('--samples', dest='samples', type=int, default=500,
+                help="The number of deals each move is evaluated on")
+@manager.option('--seed', dest='seed', type=int, default=None)
+@manager.option('--output', dest='output', default='opening-table.bin')
+def openings(samples, seed, output):
+    """Build the table of opening move values, see app.openings"""
+    from app.openings import build_table, write_table
+
+    def progress(num_players, card_one, card_two):
+        print("{0} players, {1} and {2}".format(num_players, card_one.name,
+                                                card_two.name))
+    start = time.time()
+    write_table(output, build_table(samples, rng=random.Random(seed),
+                                    progress=progress))
+    print("Wrote {0} in {1:.0f}s".format(output, time.time() - start))
+    return 0
+
+
+@manager.option('--batch-size', dest='batch_size', type=int, default=100)
+@manager.option('--max-batches', dest='max_batches', type=int, default=None)
+@manager.option('--backfill', dest='backfill', action='store_true',
+                help="First mark games finished before this was recorded")
+def archive(batch_size, max_batches, backfill):
+    """Move finished games into the archive, in batches"""
+    if backfill:
+        print("Marked {0} finished games".format(
+            main.mark_finished_games(batch_size=batch_size)))
+    num_archived = main.archive_finished_games(batch_size=batch_size,
+                                               max_batches=max_batches)
+    print("Archived {0} games".format(num_archived))
+    return 0
+
+
+def report_throughput(action, num_games, num_records, seconds):
+    seconds = max(seconds, 1e-9)
+    print("{0} {1} games ({2} records) in {3:.2f}s, {4:.0f} records/s".format(
+        action, num_games, num_records, seconds, num_records / seconds))
+
+
+def export_games(filename, chunk_size=500):
+    """Export the log of every game as gzipped JSON lines, one per entry"""
+    start = time.perf_counter()
+    num_games = num_records = 0
+    game_id = None
+    with gzip.open(filename, 'wt', encoding='utf-8') as output:
+        for record in main.iter_game_records(chunk_size=int(chunk_size)):
+            output.write(json.dumps(record, separators=(',', ':')))
+            output.write('\n')
+            if record['game_id'] != game_id:
+                game_id = record['game_id']
+                num_games += 1
+            num_records += 1
+    report_throughput("Exported", num_games, num_records,
+                      time.perf_counter() - start)
+    return 0
+
+
+def import_games(filename, batch_size=500):
+    """Import games exported with export-games, under new game ids"""
+    start = time.perf_counter()
+    num_records = 0
+
+    def read_records():
+        nonlocal num_records
+        with gzip.open(filename, 'rt', encoding='utf-8') as source:
+            for line in source:
+                num_records += 1
+                yield json.loads(line)
+
+    num_games = main.import_game_records(read_records(),
+                                         batch_size=int(batch_size))
+    report_throughput("Imported", num_games, num_records,
+                      time.perf_counter() - start)
+    return 0
+
+
+manager.add_command('export-games', Command(export_games))
+manager.add_command('import-games', Command(import_games))
+
+
+def verify_games(checkpoint='verify-games.json', workers=0, batch=500,
+                 fresh=False):
+    """Replay every stored game, reporting those which fail or disagree"""
+    from app.verify import read_checkpoint, verify
+    progress = None if fresh else read_checkpoint(checkpoint)
+    if progress is not None:
+        print("Resuming after {0} games, from {1[0]} #{1[1]}".format(
+            progress.checked, progress.position))
+
+    def report(problem):
+        print("{0.source} #{0.game_id}: {0.message}".format(problem))
+
+    start = time.perf_counter()
+    chunks = main.iter_stored_games(
+        after=None if progress is None else progress.position,
+        chunk_size=int(batch))
+    progress = verify(chunks, workers=int(workers) or None,
+                      checkpoint=checkpoint, progress=progress,
+                      on_problem=report)
+    print("Checked {0} games in {1:.0f}s, {2} problems".format(
+        progress.checked, time.perf_counter() - start, progress.problems))
+    return 1 if progress.problems else 0
+
+
+manager.add_command('verify-games', Command(verify_games))
+
+
+def revoke_tokens(game_no):
+    """Revoke the viewer tokens of a game, printing a new link per player"""
+    db_game = database.session.query(main.DBGame).get(int(game_no))
+    if db_game is None:
+        print("Game #{0} not found".format(game_no))
+        return 1
+    new_tokens = db_game.revoke_tokens()
+    database.session.commit()
+    with application.test_request_context():
+        for gamename, token in sorted(new_tokens.items()):
+            url = flask.url_for('main.viewgame', game_no=db_game.id,
+                                token=token)
+            print("{0}: {1}".format(gamename, url))
+    return 0
+
+
+manager.add_command('revoke-tokens', Command(revoke_tokens))
+
+
+@manager.option('--port', dest='port', type=int, default=5000)
+@manager.option('--workers', dest='workers', required=True,
+                help="Comma separated base urls of the workers")
+def run_router(port, workers):
+    """Route the requests for each game to the worker which owns it"""
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIServer, make_server
+    from app.routing import Router
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    router = Router(workers.split(','))
+    server = make_server('', port, router, server_class=ThreadingWSGIServer)
+    print("Routing port {0} to {1}".format(port, ", ".join(router.ring.nodes)))
+    server.serve_forever()
+
+
 @manager.command
 def run_test_server():
     """Used by the phantomjs tests to run a live testing server"""
@@ -0,0 +1,64 @@
+"""never reuse game and profile ids
+
+Revision ID: a3d7f1c9e2b
+Revises: 9f2c6e4b8a1
+Create Date: 2026-10-20 10:12:40.118205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3d7f1c9e2b'
+down_revision = '9f2c6e4b8a1'
+
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def archived_maxima(connection):
+    """ The largest game and profile ids used by the archived games, whose
+        rows have been deleted from the game and profile tables.
+    """
+    max_game_id = max_profile_id = 0
+    for game_id, data in connection.execute(
+            sa.text('SELECT id, data FROM archived_game')):
+        data = json.loads(zlib.decompress(data).decode('utf-8'))
+        max_game_id = max(max_game_id, game_id)
+        for player in data['players']:
+            max_profile_id = max(max_profile_id, player['id'] or 0)
+    return max_game_id, max_profile_id
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'sqlite':
+        # Other databases take ids from sequences, which never go back.
+        return
+    # SQLite only gives a table AUTOINCREMENT when it is created, so the
+    # tables are rebuilt, and the sequence set past the archived ids.
+    for table in ['game', 'db_light_profile']:
+        with op.batch_alter_table(
+                table, recreate='always',
+                table_kwargs={'sqlite_autoincrement': True}):
+            pass
+    max_game_id, max_profile_id = archived_maxima(connection)
+    for table, archived_max in [('game', max_game_id),
+                                ('db_light_profile', max_profile_id)]:
+        current = connection.execute(sa.text(
+            'SELECT COALESCE(MAX(id), 0) FROM {0}'.format(table))).scalar()
+        connection.execute(sa.text(
+            'DELETE FROM sqlite_sequence WHERE name = :name'), name=table)
+        connection.execute(sa.text(
+            'INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+            name=table, seq=max(current, archived_max))
+
+
+def downgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'sqlite':
+        return
+    for table in ['game', 'db_light_profile']:
+        with op.batch_alter_table(table, recreate='always'):
+            pass